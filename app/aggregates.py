@@ -0,0 +1,136 @@
+import threading
+import time
+import uuid
+from collections import deque
+
+from lead_store import shards_of
+
+BUCKETS = {
+    'by_day': lambda lead: (lead.get('created_at') or '')[:10],
+    'by_customer_type': lambda lead: lead.get('customer_type') or '',
+    'by_product_type': lambda lead: lead.get('product_type') or '',
+}
+
+
+class RollingAggregates:
+    """Dashboard counts (leads per day, customer type and product) kept in memory.
+
+    The counts are built once from the store and then advanced by reading
+    only the leads added or changed after ``high_water_seq``; versions the
+    store replaced since ``history_id`` are subtracted if they were counted.
+    Both are kept per shard of a sharded store.
+    Every refresh that finds changes records a delta with an increasing
+    ``seq`` so open dashboards can be sent just the change instead of a new
+    snapshot. ``seq`` only means something together with ``instance``,
+    which differs between processes and between instances.
+    """
+
+    def __init__(self, store, refresh_interval=2.0, max_deltas=1000):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.high_water_seq = {}
+        self.history_id = {}
+        self.instance = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.total = 0
+        self.counts = {bucket: {} for bucket in BUCKETS}
+        self._deltas = deque(maxlen=max_deltas)
+        self._last_refresh = 0.0
+        self._changed = threading.Condition()
+        self._refresh_lock = threading.Lock()
+
+    def maybe_refresh(self):
+        """Refresh if the last refresh is older than ``refresh_interval``."""
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        # Only one request thread reads the store, the others keep the current
+        # counts; until the first build is done there are none, so they wait for it
+        built = self._last_refresh > 0
+        if not self._refresh_lock.acquire(blocking=not built):
+            return
+        try:
+            if not built and self._last_refresh > 0:
+                # Another thread built the counts while this one waited
+                return
+            self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self):
+        delta = {bucket: {} for bucket in BUCKETS}
+        added = changed = 0
+        high_water_seq, history_id = dict(self.high_water_seq), dict(self.history_id)
+        fields = ['created_at', 'customer_type', 'product_type']
+
+        def count(lead, step):
+            for bucket, key_of in BUCKETS.items():
+                key = key_of(lead)
+                delta[bucket][key] = delta[bucket].get(key, 0) + step
+
+        for shard, store in shards_of(self.store).items():
+            counted_seq = self.high_water_seq.get(shard, 0)
+            # Replaced versions first: a lead updated after this read is simply
+            # subtracted on the next refresh
+            for old in store.replaced_since(history_id.get(shard, 0), fields=fields):
+                history_id[shard] = old['history_id']
+                if old['seq'] <= counted_seq:
+                    count(old, -1)
+                    added -= 1
+                    changed += 1
+            for chunk in store.iter_changes(counted_seq, 5000, fields=fields):
+                for lead in chunk:
+                    count(lead, 1)
+                added += len(chunk)
+                changed += len(chunk)
+                high_water_seq[shard] = chunk[-1]['seq']
+
+        with self._changed:
+            self._last_refresh = time.monotonic()
+            self.history_id = history_id
+            if not changed:
+                return
+            self.high_water_seq = high_water_seq
+            self.total += added
+            for bucket, changes in delta.items():
+                counts = self.counts[bucket]
+                for key, count in list(changes.items()):
+                    if not count:
+                        del changes[key]
+                        continue
+                    counts[key] = counts.get(key, 0) + count
+                    if counts[key] <= 0:
+                        del counts[key]
+            self.seq += 1
+            self._deltas.append(dict(delta, seq=self.seq, total=added))
+            self._changed.notify_all()
+
+    def snapshot(self):
+        self.maybe_refresh()
+        with self._changed:
+            return {
+                'seq': self.seq,
+                'total': self.total,
+                **{bucket: dict(sorted(counts.items())) for bucket, counts in self.counts.items()},
+            }
+
+    def deltas_since(self, seq):
+        """Deltas newer than ``seq``, or None if they are no longer all kept."""
+        with self._changed:
+            if seq == self.seq:
+                return []
+            if seq > self.seq or not self._deltas or self._deltas[0]['seq'] > seq + 1:
+                return None
+            return [delta for delta in self._deltas if delta['seq'] > seq]
+
+    def wait(self, seq, timeout):
+        """Block until there is something newer than ``seq`` or ``timeout`` passes."""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.maybe_refresh()
+            with self._changed:
+                if self.seq != seq:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._changed.wait(min(remaining, self.refresh_interval))
@@ -0,0 +1,56 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """In-process cache of serialized API responses keyed by data version.
+
+    Each entry holds the response bytes built for one store version, so a
+    request for unchanged data costs one version lookup. Concurrent misses
+    for the same key wait on a per-key lock and reuse the single rebuild.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(key, version):
+        """Strong ETag for ``key`` at ``version``, known without building the body."""
+        return hashlib.sha1(f'{key}\0{version}'.encode('utf-8')).hexdigest()
+
+    def _lookup(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+        return None
+
+    def get(self, key, version, build):
+        """Return the cached bytes for ``key`` at ``version``, calling ``build`` on a miss."""
+        body = self._lookup(key, version)
+        if body is not None:
+            return body
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another request may have rebuilt it while we were waiting
+            body = self._lookup(key, version)
+            if body is not None:
+                return body
+            body = build()
+            with self._lock:
+                self._entries[key] = (version, body)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    old_key, _ = self._entries.popitem(last=False)
+                    self._locks.pop(old_key, None)
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
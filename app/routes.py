@@ -1,8 +1,171 @@
+import csv
+import io
+import json
+import logging
 import os
-from flask import Blueprint, render_template, jsonify
-import pandas as pd
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from flask import Blueprint, Response, current_app, g, render_template, jsonify, request
+from app.aggregates import RollingAggregates
+from app.cache import ResponseCache
+from metrics import CONTENT_TYPE, REGISTRY, SIZE_BUCKETS
+from lead_snapshot import open_snapshot
+from lead_store import DATE_FORMAT, FIELD_NAMES, HEADER_BY_FIELD, LEAD_FIELDS, open_store, store_path, stream_excel, to_record
 
 main = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Workbook bytes buffered ahead of a slow client, in 64KB chunks
+XLSX_BUFFER_SIZE = 64 * 1024
+XLSX_QUEUE_SIZE = 16
+FIELD_BY_HEADER = {header: name for name, header in LEAD_FIELDS}
+
+# Seconds between keep-alive comments on idle dashboard streams
+STREAM_HEARTBEAT = 15
+# A stream ends after this many seconds and the browser reconnects, so an open
+# dashboard does not hold a worker thread forever
+STREAM_MAX_DURATION = 300
+
+_store = None
+_aggregates = None
+response_cache = ResponseCache()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time to build API responses', ['endpoint', 'status'])
+RESPONSE_SIZE = REGISTRY.histogram(
+    'http_response_size_bytes', 'Size of API response bodies', ['endpoint'], buckets=SIZE_BUCKETS)
+
+@main.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@main.after_request
+def record_request(response):
+    # Streaming responses are timed until the first byte, their size is unknown
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_LATENCY.observe(time.perf_counter() - g.request_start,
+                            endpoint=endpoint, status=response.status_code)
+    if response.content_length is not None:
+        RESPONSE_SIZE.observe(response.content_length, endpoint=endpoint)
+    return response
+
+def get_store():
+    global _store, _aggregates
+    # The workbook read before the bot created the database gives way to it
+    if _store is not None and _store.path not in (None, store_path()) and os.path.exists(store_path()):
+        _store = _aggregates = None
+    if _store is None:
+        # The web app only reads, and may run on a read-only file system
+        _store = open_store(read_only=True)
+    return _store
+
+def get_aggregates():
+    global _aggregates
+    if _aggregates is None:
+        _aggregates = RollingAggregates(get_store())
+    return _aggregates
+
+def parse_date(value, end=False):
+    """Parse a since/until bound; a bare date as ``until`` includes that whole day."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'تاريخ غير صالح: {value}')
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.strftime(DATE_FORMAT)
+
+def parse_int(name, minimum=0, maximum=None):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f'قيمة غير صالحة للمعامل {name}: {value}')
+    if number < minimum or (maximum is not None and number > maximum):
+        raise ValueError(f'قيمة غير صالحة للمعامل {name}: {value}')
+    return number
+
+def parse_filters():
+    """Read the date range and customer/product type filters from the query string."""
+    filters = {}
+    if request.args.get('since'):
+        filters['since'] = parse_date(request.args['since'])
+    if request.args.get('until'):
+        filters['until'] = parse_date(request.args['until'], end=True)
+    for name in ('customer_type', 'product_type'):
+        if request.args.get(name):
+            filters[name] = request.args[name]
+    return filters
+
+def parse_fields():
+    """Read the ``fields=`` projection, accepting field names or column headers."""
+    if not request.args.get('fields'):
+        return None
+    fields = []
+    for field in request.args['fields'].split(','):
+        field = FIELD_BY_HEADER.get(field.strip(), field.strip())
+        if field not in FIELD_NAMES:
+            raise ValueError(f'حقل غير معروف: {field}')
+        fields.append(field)
+    return fields
+
+def cache_key(name):
+    return name + '?' + urlencode(sorted(request.args.items(multi=True)))
+
+def cached_json(key, build):
+    """Serve the JSON built by ``build`` from the cache, answering 304 when the
+    client already has the current version."""
+    version = get_store().version()
+    etag = ResponseCache.etag(key, version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = response_cache.get(
+            key, version, lambda: current_app.json.dumps(build(), separators=(',', ':')).encode('utf-8')
+        )
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def error_response(message, status):
+    return jsonify({
+        'status': 'error',
+        'message': message
+    }), status
+
+def build_sales_data(filters, fields, limit, cursor, offset):
+    query_fields = None if fields is None else ['id'] + fields
+    # Full reads come from the columnar snapshot when pyarrow is installed,
+    # pages are cheaper as indexed store queries
+    snapshot = open_snapshot(get_store()) if limit is None and cursor is None and offset is None else None
+    if snapshot is not None:
+        leads = snapshot.query(fields=query_fields, **filters)
+    else:
+        leads = get_store().query(after_id=cursor, limit=limit, offset=offset, fields=query_fields, **filters)
+    result = {
+        'status': 'success',
+        'data': [to_record(lead, fields) for lead in leads]
+    }
+    if limit is not None:
+        result['next_cursor'] = leads[-1]['id'] if len(leads) == limit else None
+    return result
+
+@main.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 @main.route('/')
 def index():
@@ -11,20 +174,226 @@ def index():
 @main.route('/api/sales-data')
 def get_sales_data():
     try:
-        # Construct the absolute path to the Excel file
-        excel_file_path = os.path.join(os.path.dirname(__file__), '..\..\customer_data.xlsx')
-        df = pd.read_excel(excel_file_path)
-        return jsonify({
-            'status': 'success',
-            'data': df.to_dict(orient='records')
-        })
+        filters = parse_filters()
+        fields = parse_fields()
+        limit = parse_int('limit', minimum=1, maximum=MAX_PAGE_SIZE)
+        cursor = parse_int('cursor')
+        offset = parse_int('offset')
+    except ValueError as e:
+        return error_response(str(e), 400)
+    if (cursor is not None or offset is not None) and limit is None:
+        limit = MAX_PAGE_SIZE
+    try:
+        return cached_json(cache_key('sales-data'),
+                           lambda: build_sales_data(filters, fields, limit, cursor, offset))
     except FileNotFoundError:
-         return jsonify({
-            'status': 'error',
-            'message': 'ملف customer_data.xlsx غير موجود. يرجى التأكد من وجوده في المسار الصحيح.'
-        }), 404
+        return error_response('ملف بيانات العملاء غير موجود. يرجى التأكد من وجوده في المسار الصحيح.', 404)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+@main.route('/api/sales-data/summary')
+def get_sales_summary():
+    try:
+        filters = parse_filters()
+    except ValueError as e:
+        return error_response(str(e), 400)
+    try:
+        return cached_json(cache_key('sales-summary'), lambda: dict(
+            status='success', **get_store().aggregate(**filters)
+        ))
+    except FileNotFoundError:
+        return error_response('ملف بيانات العملاء غير موجود. يرجى التأكد من وجوده في المسار الصحيح.', 404)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+def export_ndjson(leads, fields):
+    for lead in leads:
+        yield json.dumps(to_record(lead, fields), ensure_ascii=False) + '\n'
+
+def export_csv(leads, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the Arabic headers correctly
+    buffer.write('\ufeff')
+    writer.writerow([HEADER_BY_FIELD[name] for name in fields or FIELD_NAMES])
+    # Sent on its own so an export with no leads still has the header
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for lead in leads:
+        writer.writerow([lead.get(name) for name in fields or FIELD_NAMES])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def stream_export(lines):
+    """Group generated lines into chunks so each write carries many rows."""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+class ExportCancelled(Exception):
+    """The client stopped reading an export that is still being written."""
+
+class QueueWriter(io.RawIOBase):
+    """Unseekable binary file handing every write to a bounded queue, so the
+    writer waits while the reader is behind. Once ``cancelled`` is set the
+    next write raises :class:`ExportCancelled`; later ones (the zip and
+    buffer closing on the way out) are dropped."""
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.aborted = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.aborted:
+            return len(data)
+        try:
+            self.put(bytes(data))
+        except ExportCancelled:
+            self.aborted = True
+            raise
+        return len(data)
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+def until_cancelled(leads, cancelled):
+    """Pass ``leads`` through, stopping the export once ``cancelled`` is set
+    instead of reading the rest of the table."""
+    for lead in leads:
+        if cancelled.is_set():
+            raise ExportCancelled
+        yield lead
+
+def export_xlsx(leads, fields):
+    """Yield an Excel workbook of ``leads`` as it is written.
+
+    The workbook is built in a thread and zipped onto an unseekable stream;
+    the sheet entry is compressed row by row, so the first bytes go out
+    while the leads are still being read. If the client disconnects the
+    thread stops at the next lead or write.
+    """
+    chunks = queue.Queue(maxsize=XLSX_QUEUE_SIZE)
+    cancelled = threading.Event()
+    writer = QueueWriter(chunks, cancelled)
+    done = object()
+
+    def build():
+        try:
+            with io.BufferedWriter(writer, XLSX_BUFFER_SIZE) as output:
+                stream_excel(until_cancelled(leads, cancelled), output, fields)
+            writer.put(done)
+        except ExportCancelled:
+            logger.info("Excel export cancelled by the client")
+        except Exception as e:
+            logger.error("Excel export failed: %s", e)
+            # Cut the download short rather than end it with a broken file
+            try:
+                writer.put(e)
+            except ExportCancelled:
+                pass
+
+    threading.Thread(target=build, name='xlsx-export', daemon=True).start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # The client went away: stop the writer instead of leaving it blocked
+        cancelled.set()
+
+@main.route('/api/sales-data/export')
+def export_sales_data():
+    """Stream the matching leads as NDJSON, CSV or an Excel workbook without
+    building them in memory."""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return error_response(f'صيغة غير مدعومة: {export_format}', 400)
+    try:
+        filters = parse_filters()
+        fields = parse_fields()
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    query_fields = None if fields is None else ['id'] + fields
+    leads = get_store().iter_leads(chunk_size=EXPORT_CHUNK_SIZE, fields=query_fields, **filters)
+    if export_format == 'xlsx':
+        body = export_xlsx(leads, fields)
+    else:
+        lines = export_csv(leads, fields) if export_format == 'csv' else export_ndjson(leads, fields)
+        body = stream_export(lines)
+    return Response(body, mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename=customer_data.{export_format}',
+        'Cache-Control': 'no-store',
+    })
+
+@main.route('/api/dashboard/aggregates')
+def get_dashboard_aggregates():
+    """Current dashboard counts, served from memory."""
+    try:
+        return jsonify({'status': 'success', **get_aggregates().snapshot()})
     except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500 
\ No newline at end of file
+        return error_response(str(e), 500)
+
+def sse_event(event, data, event_id):
+    return f'event: {event}\nid: {event_id}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+@main.route('/api/dashboard/stream')
+def stream_dashboard():
+    """Server-Sent Events: a snapshot first, then only the deltas as leads arrive.
+
+    Event ids are ``<instance>-<seq>``. A reconnecting client sends
+    ``Last-Event-ID`` and gets the missed deltas, or a fresh snapshot if they
+    are no longer kept or the id comes from another worker process.
+    """
+    aggregates = get_aggregates()
+    instance, _, last_seq = request.headers.get('Last-Event-ID', '').rpartition('-')
+    last_seq = int(last_seq) if instance == aggregates.instance and last_seq.isdigit() else None
+
+    def event_id(seq):
+        return f'{aggregates.instance}-{seq}'
+
+    def events(seq):
+        deadline = time.monotonic() + STREAM_MAX_DURATION
+        if seq is None or aggregates.deltas_since(seq) is None:
+            snapshot = aggregates.snapshot()
+            seq = snapshot['seq']
+            yield sse_event('snapshot', snapshot, event_id(seq))
+        while time.monotonic() < deadline:
+            aggregates.wait(seq, min(STREAM_HEARTBEAT, deadline - time.monotonic()))
+            deltas = aggregates.deltas_since(seq)
+            if deltas is None:
+                snapshot = aggregates.snapshot()
+                seq = snapshot['seq']
+                yield sse_event('snapshot', snapshot, event_id(seq))
+            elif not deltas:
+                yield ': keep-alive\n\n'
+            for delta in deltas or []:
+                seq = delta['seq']
+                yield sse_event('delta', delta, event_id(seq))
+
+    return Response(events(last_seq), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,5 @@
+"""Offline benchmarks for the bot and the data path.
+
+Run them from the repository root as modules, e.g.
+``python -m benchmarks.load_test``.
+"""
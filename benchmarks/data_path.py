@@ -0,0 +1,233 @@
+"""Benchmarks for the lead data path at growing sizes.
+
+For every store format and size the synthetic leads are written to a new
+store, then each path that reads or writes leads is timed:
+
+    write        bulk import of all the leads
+    append       one lead writer batch appended to the full store
+    snapshot     building the columnar snapshot from scratch (needs pyarrow)
+    load_frame   loading the analyzer's DataFrame (from the snapshot if built)
+    load_store   loading the same DataFrame straight from the store
+    analyze      the whole analyzer computation (analyze_store)
+    api_page     GET /api/sales-data?limit=1000
+    api_full     GET /api/sales-data (every lead)
+    api_summary  GET /api/sales-data/summary
+    export_xlsx  export_to_excel of every lead (write-only workbook)
+    read_excel   pd.read_excel of the workbook (xlsx only, the old API path)
+
+Each operation is run once for time and once more under tracemalloc for
+peak memory, so tracing does not slow down the timings.
+
+    python -m benchmarks.data_path --sizes 1k,10k,100k --output data_path.json
+    python -m benchmarks.data_path --sizes 1m --formats sqlite --baseline data_path.json
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import lead_snapshot
+from benchmarks.synthetic import generate_leads
+from lead_store import ExcelLeadStore, export_to_excel, open_store
+
+FORMATS = {'sqlite': 'leads.db', 'xlsx': 'leads.xlsx'}
+APPEND_BATCH = 50
+WRITE_CHUNK = 50000
+API_URLS = {
+    'api_page': '/api/sales-data?limit=1000',
+    'api_full': '/api/sales-data',
+    'api_summary': '/api/sales-data/summary',
+}
+
+
+def parse_size(value):
+    """Parse a row count such as ``1000``, ``10k`` or ``1m``."""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def write_leads(store, leads):
+    if isinstance(store, ExcelLeadStore):
+        # Every Excel append rewrites the workbook, so write it once
+        store.append_many(leads)
+        return
+    while True:
+        chunk = list(itertools.islice(leads, WRITE_CHUNK))
+        if not chunk:
+            return
+        store.append_many(chunk)
+
+
+def measure(func, memory=True):
+    """Return ``(seconds, peak_bytes)`` for ``func``; the peak comes from a second run."""
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+class APIClient:
+    """Flask test client pointed at a given store with an empty response cache."""
+
+    def __init__(self):
+        from app import create_app
+        from app import routes
+        self.routes = routes
+        self.client = create_app().test_client()
+
+    def get(self, store, url):
+        self.routes._store = store
+        self.routes._aggregates = None
+        self.routes.response_cache.clear()
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        return len(response.get_data())
+
+
+def bench_store(fmt, rows, tmp, args, api):
+    from customer_analysis import analyze_store, load_frame
+
+    paths = (os.path.join(tmp, f'{rows}-{n}-{FORMATS[fmt]}') for n in itertools.count())
+
+    def write():
+        store = open_store(next(paths))
+        write_leads(store, generate_leads(rows, seed=args.seed))
+        store.close()
+
+    def append():
+        store.append_many(list(generate_leads(APPEND_BATCH, seed=args.seed + 1)))
+
+    results = []
+
+    def record(operation, func, **extra):
+        seconds, peak = measure(func, memory=not args.no_memory)
+        results.append({
+            'format': fmt,
+            'rows': rows,
+            'operation': operation,
+            'seconds': round(seconds, 6),
+            'rows_per_second': round(rows / seconds, 1) if seconds else None,
+            'peak_bytes': peak,
+            **extra,
+        })
+        print(f'{fmt:<8}{rows:>10}  {operation:<12}{seconds:>10.4f}s'
+              + (f'{peak / 2 ** 20:>10.1f} MB' if peak is not None else ''), flush=True)
+
+    record('write', write)
+    first_path = os.path.join(tmp, f'{rows}-0-{FORMATS[fmt]}')
+    store = open_store(first_path)
+    record('append', append, batch=APPEND_BATCH)
+    if lead_snapshot.available():
+        record('snapshot', lambda: lead_snapshot.LeadSnapshot(store).refresh(rebuild=True))
+    record('load_frame', lambda: load_frame(store))
+    record('load_store', lambda: load_frame(store, use_snapshot=False))
+    record('analyze', lambda: analyze_store(store))
+    for operation, url in API_URLS.items():
+        sizes = []
+        record(operation, lambda: sizes.append(api.get(store, url)))
+        results[-1]['response_bytes'] = sizes[0]
+    record('export_xlsx', lambda: export_to_excel(store, os.path.join(tmp, f'{rows}-export.xlsx')))
+    if fmt == 'xlsx':
+        import pandas as pd
+        try:
+            record('read_excel', lambda: pd.read_excel(first_path))
+        except ImportError as e:
+            # pandas pins a minimum openpyxl version for its Excel reader
+            print(f'{fmt:<8}{rows:>10}  read_excel skipped: {e}')
+    results[0]['file_bytes'] = os.path.getsize(first_path)
+    store.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print the time ratio against a previous results file."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {
+            (r['format'], r['rows'], r['operation']): r['seconds'] for r in json.load(f)['results']
+        }
+    print(f"\ncompared with {baseline_path}:")
+    for r in results:
+        before = baseline.get((r['format'], r['rows'], r['operation']))
+        if before:
+            print(f"{r['format']:<8}{r['rows']:>10}  {r['operation']:<12}"
+                  f"{before:>10.4f}s -> {r['seconds']:.4f}s  x{r['seconds'] / before:.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the lead data path at growing sizes')
+    parser.add_argument('--sizes', default='1k,10k,100k',
+                        help='comma separated row counts, e.g. 1k,10k,100k,1m (default 1k,10k,100k)')
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help=f'comma separated store formats out of {", ".join(FORMATS)}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare with')
+    args = parser.parse_args(argv)
+    args.sizes = [parse_size(size) for size in args.sizes.split(',')]
+    args.formats = [fmt.strip() for fmt in args.formats.split(',')]
+    unknown = set(args.formats) - set(FORMATS)
+    if unknown:
+        parser.error(f'unknown format: {", ".join(sorted(unknown))}')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    api = APIClient()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='albadr-data-') as tmp:
+        for rows in args.sizes:
+            for fmt in args.formats:
+                results.extend(bench_store(fmt, rows, tmp, args, api))
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+            'formats': args.formats,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Albadr Sales', 'username': 'albadr_sales_bot'}
+
+
+class FakeBotAPI(BaseRequest):
+    """Bot API stand-in that answers every call locally.
+
+    Each call waits ``latency`` seconds to mimic the round trip to
+    Telegram, is counted in ``calls`` by method name and, for messages,
+    recorded in ``sent`` as ``(method, parameters)``.
+    """
+
+    def __init__(self, latency=0.0, keep_sent=False):
+        self.latency = latency
+        self.keep_sent = keep_sent
+        self.calls = Counter()
+        self.sent = []
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, parameters):
+        self._message_id += 1
+        chat_id = parameters.get('chat_id', 0)
+        return {
+            'message_id': parameters.get('message_id', self._message_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if int(chat_id) > 0 else 'group'},
+            'from': BOT_USER,
+            'text': parameters.get('text', ''),
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        self.calls[endpoint] += 1
+        # A real HTTP call always yields to the event loop, even when it is fast
+        await asyncio.sleep(self.latency)
+
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint == 'getUpdates':
+            result = []
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            result = self._message(parameters)
+            if self.keep_sent:
+                self.sent.append((endpoint, dict(parameters)))
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
@@ -0,0 +1,285 @@
+"""Offline load test for the sales conversation.
+
+Simulated Telegram users go through the whole funnel (start, interested,
+classification, phone, email, product, budget, timeline, company, size,
+notes) concurrently. Updates go through the bot's real update processor
+and ConversationHandler, Bot API calls are answered by ``FakeBotAPI`` and
+finished leads are written by the lead writer to a temporary store. Hot
+leads are alerted to a fake sales team group, so the report also shows how
+many digest messages the burst produced.
+
+    python -m benchmarks.load_test --users 2000 --concurrency 500
+    python -m benchmarks.load_test --store-format xlsx --output load.json --max-p95 250
+
+The report has throughput, p50/p95/p99 latency per funnel step and the
+cost of writing leads to the store. With ``--max-p95`` the exit code is 1
+when the overall p95 latency (ms) is above the limit, so the run can gate
+regressions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.fake_bot import FakeBotAPI
+
+CUSTOMER_TYPES = ['hot', 'warm', 'cold']
+PRODUCT_TYPES = ['software', 'hardware', 'service', 'other']
+FIRST_USER_ID = 100000
+SALES_TEAM_CHAT_ID = '-1001000000000'
+STORE_FILES = {'sqlite': 'leads.db', 'xlsx': 'leads.xlsx'}
+
+
+class UpdateFactory:
+    """Builds the raw update dicts a Telegram client would send."""
+
+    def __init__(self):
+        self.update_id = 0
+
+    def _next_id(self):
+        self.update_id += 1
+        return self.update_id
+
+    def message(self, user_id, text):
+        update_id = self._next_id()
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id, data):
+        update_id = self._next_id()
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': '-',
+                },
+            },
+        }
+
+    def funnel(self, user_id, rng):
+        """``(step, update)`` pairs for one user going through the whole funnel."""
+        return [
+            ('start', self.message(user_id, '/start')),
+            ('interested', self.callback(user_id, 'interested')),
+            ('classify', self.callback(user_id, rng.choice(CUSTOMER_TYPES))),
+            ('phone', self.message(user_id, f'05{rng.randrange(10 ** 8):08d}')),
+            ('email', self.message(user_id, f'user{user_id}@example.com')),
+            ('product', self.callback(user_id, rng.choice(PRODUCT_TYPES))),
+            ('budget', self.message(user_id, str(rng.randrange(5, 500) * 1000))),
+            ('timeline', self.message(user_id, rng.choice(['خلال شهر', 'خلال 3 أشهر', 'خلال سنة']))),
+            ('company', self.message(user_id, f'شركة {user_id}')),
+            ('size', self.message(user_id, str(rng.randrange(1, 500)))),
+            ('notes', self.message(user_id, rng.choice(['لا', 'نحتاج عرض سعر']))),
+        ]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def latency_summary(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3) if samples else 0.0,
+    }
+
+
+def store_size(path):
+    """Size of the store including SQLite's write-ahead log."""
+    return sum(os.path.getsize(name) for name in (path, path + '-wal') if os.path.exists(name))
+
+
+async def simulate_user(application, updates, steps, latencies, think_time, rng):
+    from telegram import Update
+
+    for step, data in steps:
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * think_time))
+        update = Update.de_json(data, application.bot)
+        start = time.perf_counter()
+        # Same path as updates fetched by polling or the webhook
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[step].append(time.perf_counter() - start)
+        updates[0] += 1
+
+
+async def run(args, sales_bot, shard):
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+    fake_api = FakeBotAPI(latency=args.api_latency / 1000)
+    application = sales_bot.build_application(shard, request=fake_api, rate_limit=args.rate_limit)
+
+    latencies = defaultdict(list)
+    updates = [0]
+    peak = {'lead_writer': 0, 'outbound_queue': 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user(user_id):
+        async with semaphore:
+            await simulate_user(application, updates, factory.funnel(user_id, rng),
+                                latencies, args.think_time / 1000, rng)
+
+    async def watch_queues():
+        rate_limiter = application.bot.rate_limiter
+        while True:
+            peak['lead_writer'] = max(peak['lead_writer'], shard.writer.pending())
+            if rate_limiter is not None:
+                peak['outbound_queue'] = max(peak['outbound_queue'], rate_limiter.stats['queue_depth'])
+            await asyncio.sleep(0.05)
+
+    async with application:
+        # post_init/post_stop/post_shutdown only run by themselves under run_polling/run_webhook
+        await application.post_init(application)
+        await application.start()
+        watcher = asyncio.create_task(watch_queues())
+        started = time.perf_counter()
+        await asyncio.gather(*(user(FIRST_USER_ID + i) for i in range(args.users)))
+        conversation_time = time.perf_counter() - started
+        await application.stop()
+        # Sends the last hot lead digest while the bot is still initialized
+        await application.post_stop(application)
+        watcher.cancel()
+
+    # Stopping the lead writer flushes every queued lead
+    flush_started = time.perf_counter()
+    await application.post_shutdown(application)
+    flush_time = time.perf_counter() - flush_started
+    wall_time = time.perf_counter() - started
+
+    all_samples = [sample for samples in latencies.values() for sample in samples]
+    writes, write_seconds = sales_bot.STORE_WRITE_LATENCY.summary()
+    leads_saved = shard.store.count()
+    return {
+        'config': {
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'store_format': args.store_format,
+            'api_latency_ms': args.api_latency,
+            'think_time_ms': args.think_time,
+            'rate_limit': args.rate_limit,
+            'max_concurrent_updates': sales_bot.MAX_CONCURRENT_UPDATES,
+            'seed': args.seed,
+        },
+        'throughput': {
+            'updates': updates[0],
+            'conversation_seconds': round(conversation_time, 3),
+            'wall_seconds': round(wall_time, 3),
+            'updates_per_second': round(updates[0] / conversation_time, 1),
+            'leads_per_second': round(leads_saved / wall_time, 1),
+        },
+        'latency': {
+            'overall': latency_summary(all_samples),
+            'steps': {step: latency_summary(samples) for step, samples in latencies.items()},
+        },
+        'storage': {
+            'leads_saved': leads_saved,
+            'batches': writes,
+            'write_seconds': round(write_seconds, 4),
+            'ms_per_lead': round(write_seconds * 1000 / leads_saved, 4) if leads_saved else 0.0,
+            'final_flush_seconds': round(flush_time, 4),
+            'peak_lead_writer_queue': peak['lead_writer'],
+            'store_bytes': store_size(shard.store.path),
+        },
+        'bot_api': {
+            'calls': dict(fake_api.calls),
+            'peak_outbound_queue': peak['outbound_queue'],
+        },
+        'alerts': dict(shard.alerter.stats),
+    }
+
+
+def print_report(results):
+    config, throughput, storage = results['config'], results['throughput'], results['storage']
+    print(f"users={config['users']} concurrency={config['concurrency']} store={config['store_format']} "
+          f"api_latency={config['api_latency_ms']}ms rate_limit={config['rate_limit']}")
+    print(f"updates: {throughput['updates']} in {throughput['conversation_seconds']}s "
+          f"({throughput['updates_per_second']}/s), leads/s: {throughput['leads_per_second']}")
+    print(f"{'step':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(results['latency']['steps'].items()) + [('overall', results['latency']['overall'])]
+    for step, summary in rows:
+        print(f"{step:<12}{summary['count']:>8}{summary['p50_ms']:>10}{summary['p95_ms']:>10}"
+              f"{summary['p99_ms']:>10}{summary['max_ms']:>10}")
+    print(f"storage: {storage['leads_saved']} leads in {storage['batches']} batches, "
+          f"{storage['write_seconds']}s writing ({storage['ms_per_lead']} ms/lead), "
+          f"peak queue {storage['peak_lead_writer_queue']}, {storage['store_bytes']} bytes")
+    alerts = results['alerts']
+    print(f"hot lead alerts: {alerts['leads']} leads in {alerts['digests']} digests "
+          f"({alerts['messages']} messages, {alerts['failures']} failed)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline load test for the sales bot funnel')
+    parser.add_argument('--users', type=int, default=1000, help='simulated users (default 1000)')
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='users going through the funnel at the same time (default 200)')
+    parser.add_argument('--store-format', choices=['sqlite', 'xlsx'], default='sqlite')
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='simulated Bot API round trip in ms (default 0)')
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help='mean pause between a user\'s messages in ms (default 0)')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='keep the outbound rate limiter (Telegram limits then dominate)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--max-p95', type=float, help='fail if the overall p95 latency (ms) is above this')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='albadr-load-') as tmp:
+        # sales_bot reads its configuration when it is imported
+        os.environ['LEAD_STORE_PATH'] = os.path.join(tmp, STORE_FILES[args.store_format])
+        os.environ['BOT_STATE_PATH'] = os.path.join(tmp, 'bot_state.db')
+        os.environ['LEAD_JOURNAL_DIR'] = os.path.join(tmp, 'lead_journal')
+        os.environ.pop('BOT_SHARDS', None)
+        import sales_bot
+
+        logging.getLogger().setLevel(args.log_level.upper())
+        shard = sales_bot.BotShard('', '123456:LOADTEST', alert_chat_id=SALES_TEAM_CHAT_ID)
+        shard.setup_store()
+        results = asyncio.run(run(args, sales_bot, shard))
+        shard.store.close()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.max_p95 is not None and results['latency']['overall']['p95_ms'] > args.max_p95:
+        print(f"p95 {results['latency']['overall']['p95_ms']}ms is above the limit of {args.max_p95}ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
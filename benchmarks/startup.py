@@ -0,0 +1,152 @@
+"""Cold start time of the web app and the analyzer.
+
+Every entry point is started in a fresh interpreter, as on a new Vercel
+instance, and timed from process start to its first result:
+
+    web        import run.py and render /
+    api        import run.py and GET /api/sales-data/summary
+    api_full   import run.py and GET /api/sales-data (the Arrow snapshot)
+    analysis   import customer_analysis
+
+The child also reports which heavy libraries (pandas, pyarrow, openpyxl,
+matplotlib...) it imported. Only the full API read may load pyarrow (which
+itself probes for pandas when it converts Python values); none of these
+paths needs the others, so loading one is reported as a failure, like
+exceeding ``--max-ms``.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --max-ms 800 --top 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'openpyxl', 'matplotlib', 'seaborn', 'arabic_reshaper', 'bidi']
+
+WEB = """
+import run
+response = run.app.test_client().get({url!r})
+assert response.status_code == 200, response.status_code
+"""
+# entry point: (code, heavy modules it may load)
+ENTRY_POINTS = {
+    'web': (WEB.format(url='/'), []),
+    'api': (WEB.format(url='/api/sales-data/summary'), []),
+    'api_full': (WEB.format(url='/api/sales-data'), ['pyarrow', 'pandas', 'numpy']),
+    'analysis': ('import customer_analysis\n', []),
+}
+
+# Runs inside the child: time the entry point and list the heavy modules it loaded
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{'seconds': seconds, 'heavy': heavy}}))
+"""
+
+
+def run_child(name, tmp, importtime=False):
+    """Start one fresh interpreter for entry point ``name``; returns its report."""
+    env = dict(os.environ, PYTHONPATH=ROOT, LEAD_STORE_PATH=os.path.join(tmp, 'leads.db'))
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else [])
+    code = CHILD.format(code=ENTRY_POINTS[name][0], heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    process = subprocess.run(command + ['-c', code], cwd=tmp, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f'{name} failed:\n{process.stderr}')
+    report = json.loads(process.stdout.strip().splitlines()[-1])
+    report['wall'] = wall
+    report['stderr'] = process.stderr
+    return report
+
+
+def python_start(runs):
+    """Median start time (ms) of a bare interpreter, to tell it apart from the repo's own cost."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def slowest_imports(stderr, top):
+    """The ``top`` modules with the largest cumulative time in ``-X importtime`` output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative) / 1000, module.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def measure(name, runs, tmp, top=0):
+    reports = [run_child(name, tmp) for _ in range(runs)]
+    result = {
+        'entry_point': name,
+        'runs': runs,
+        'wall_ms': round(statistics.median(r['wall'] for r in reports) * 1000, 1),
+        'entry_ms': round(statistics.median(r['seconds'] for r in reports) * 1000, 1),
+        'heavy_modules': reports[0]['heavy'],
+        'unexpected_modules': sorted(set(reports[0]['heavy']) - set(ENTRY_POINTS[name][1])),
+    }
+    if top:
+        result['slowest_imports'] = slowest_imports(run_child(name, tmp, importtime=True)['stderr'], top)
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the cold start of the web app and the analyzer')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per entry point (default 5)')
+    parser.add_argument('--entry-points', default=','.join(ENTRY_POINTS),
+                        help=f'comma separated out of {", ".join(ENTRY_POINTS)}')
+    parser.add_argument('--top', type=int, default=0, help='also list the N slowest imports of each')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--max-ms', type=float, help='fail if a median wall time (ms) is above this')
+    args = parser.parse_args(argv)
+    args.entry_points = [name.strip() for name in args.entry_points.split(',')]
+    unknown = set(args.entry_points) - set(ENTRY_POINTS)
+    if unknown:
+        parser.error(f'unknown entry point: {", ".join(sorted(unknown))}')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='albadr-startup-') as tmp:
+        baseline = python_start(args.runs)
+        results = [measure(name, args.runs, tmp, args.top) for name in args.entry_points]
+
+    print(f'python start: {baseline:.1f} ms')
+    print(f"{'entry point':<12}{'wall ms':>10}{'entry ms':>10}  heavy modules")
+    failed = False
+    for result in results:
+        print(f"{result['entry_point']:<12}{result['wall_ms']:>10}{result['entry_ms']:>10}  "
+              f"{', '.join(result['heavy_modules']) or '-'}")
+        for ms, module in result.get('slowest_imports', []):
+            print(f"{'':<12}{ms:>10.1f}  {module}")
+        if result['unexpected_modules']:
+            print(f"{result['entry_point']} imported {', '.join(result['unexpected_modules'])}")
+            failed = True
+        if args.max_ms is not None and result['wall_ms'] > args.max_ms:
+            print(f"{result['entry_point']} took {result['wall_ms']}ms, above the limit of {args.max_ms}ms")
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'python_start_ms': round(baseline, 1), 'results': results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Synthetic leads that look like the ones the bot collects.
+
+The values follow the bot's funnel: the same customer and product types,
+Saudi phone numbers, budgets typed as free text, Arabic timelines, company
+names and notes. Generation is seeded so every run sees the same data.
+"""
+import random
+from datetime import datetime, timedelta
+
+from lead_store import DATE_FORMAT
+
+CUSTOMER_TYPES = ['عميل محتمل عالي', 'عميل محتمل متوسط', 'عميل محتمل منخفض']
+# Hot leads are the rarest, as in the real data
+CUSTOMER_TYPE_WEIGHTS = [2, 5, 3]
+PRODUCT_TYPES = ['برامج إدارة المبيعات', 'أجهزة ومعدات', 'خدمات استشارية', 'أخرى']
+FIRST_NAMES = ['محمد', 'أحمد', 'عبدالله', 'خالد', 'فهد', 'سارة', 'نورة', 'ريم', 'عمر', 'يوسف', 'ليلى', 'هند']
+LAST_NAMES = ['العتيبي', 'القحطاني', 'الشهري', 'الزهراني', 'الغامدي', 'الدوسري', 'المطيري', 'الحربي']
+COMPANY_WORDS = ['البدر', 'النخبة', 'الريادة', 'الأفق', 'المستقبل', 'الإتقان', 'الوفاء', 'الشرق']
+COMPANY_KINDS = ['للتجارة', 'للمقاولات', 'للتقنية', 'للخدمات', 'القابضة']
+TIMELINES = ['خلال شهر', 'خلال 3 أشهر', 'خلال 6 أشهر', 'خلال سنة', 'غير محدد']
+BUDGETS = ['5000', '10000', '25,000', '50 ألف', '100000', '250 ألف ريال', 'غير محددة']
+COMPANY_SIZES = ['1-10', '11-50', '51-200', '200+', '15', '40', '120']
+NOTES = ['لا توجد ملاحظات', 'نحتاج عرض سعر', 'التواصل عبر واتساب', 'نرغب بعرض تجريبي', 'التواصل بعد العصر']
+
+
+def generate_leads(count, seed=0, start=None, days=365):
+    """Yield ``count`` leads spread evenly over ``days`` days from ``start``."""
+    rng = random.Random(seed)
+    start = start or datetime(2024, 1, 1)
+    span = days * 24 * 3600
+    for i in range(count):
+        created_at = start + timedelta(seconds=span * i // max(count, 1) + rng.randrange(60))
+        first_name = rng.choice(FIRST_NAMES)
+        has_email = rng.random() < 0.8
+        yield {
+            'created_at': created_at.strftime(DATE_FORMAT),
+            'username': f'{first_name} {rng.choice(LAST_NAMES)}' if rng.random() < 0.6 else f'user_{i}',
+            'user_id': 100000000 + rng.randrange(900000000),
+            'customer_type': rng.choices(CUSTOMER_TYPES, CUSTOMER_TYPE_WEIGHTS)[0],
+            'phone': f'05{rng.randrange(10 ** 8):08d}',
+            'email': f'user{i}@example.com' if has_email else None,
+            'product_type': rng.choice(PRODUCT_TYPES),
+            'budget': rng.choice(BUDGETS),
+            'timeline': rng.choice(TIMELINES),
+            'company_name': f'شركة {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_KINDS)}',
+            'company_size': rng.choice(COMPANY_SIZES),
+            'notes': rng.choice(NOTES),
+        }
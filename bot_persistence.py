@@ -0,0 +1,203 @@
+"""Conversation and lead-draft persistence for the sales bot.
+
+``SQLitePersistence`` keeps the ``ConversationHandler`` states and each
+user's ``LeadDraft`` in a small SQLite database so a restart resumes every
+conversation where it stopped. PTB hands over changed entries once per
+``update_interval``; they are written together in one transaction from a
+worker thread. Entries older than ``max_age`` are dropped when loading, and
+``idle_users`` finds the users to evict while the bot runs.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections.abc import MutableMapping
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from lead_store import FIELD_NAMES
+
+logger = logging.getLogger(__name__)
+
+DRAFT_FIELDS = tuple(name for name in FIELD_NAMES if name != 'created_at')
+
+
+class LeadDraft(MutableMapping):
+    """A user's in-progress lead with a fixed set of fields.
+
+    Used as ``context.user_data`` so handlers keep their dict-style access,
+    while each idle user costs one slotted object instead of a growing dict.
+    Unset fields are ``None`` and behave like missing keys.
+    """
+
+    __slots__ = DRAFT_FIELDS
+
+    def __init__(self, data=None):
+        for name in DRAFT_FIELDS:
+            setattr(self, name, None)
+        if data:
+            self.update(data)
+
+    def __getitem__(self, key):
+        if key not in DRAFT_FIELDS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in DRAFT_FIELDS:
+            raise KeyError(f"Unknown lead field: {key}")
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        self[key]
+        setattr(self, key, None)
+
+    def __iter__(self):
+        return (name for name in DRAFT_FIELDS if getattr(self, name) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return (LeadDraft, (self.to_dict(),))
+
+    def __repr__(self):
+        return f"LeadDraft({self.to_dict()!r})"
+
+    def clear(self):
+        for name in DRAFT_FIELDS:
+            setattr(self, name, None)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self}
+
+
+class SQLitePersistence(BasePersistence):
+    """Persists conversation states and user lead drafts in SQLite."""
+
+    def __init__(self, path, update_interval=10, max_age=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.max_age = max_age
+        self._pending = {}
+        self._flush_task = None
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'kind TEXT, key TEXT, value TEXT, updated_at REAL, PRIMARY KEY (kind, key))'
+            )
+
+    def _load(self, kind):
+        if self.max_age is not None:
+            with self._conn:
+                self._conn.execute(
+                    'DELETE FROM state WHERE kind = ? AND updated_at < ?', (kind, time.time() - self.max_age)
+                )
+        return self._conn.execute('SELECT key, value FROM state WHERE kind = ?', (kind,)).fetchall()
+
+    @staticmethod
+    def _user_of(kind, key):
+        # Conversation keys are [chat id, user id]
+        return int(key) if kind == 'user' else json.loads(key)[-1]
+
+    def idle_users(self, max_age):
+        """Users whose conversation states and draft all changed more than
+        ``max_age`` seconds ago."""
+        last_update = {}
+        for kind, key, updated_at in self._conn.execute('SELECT kind, key, updated_at FROM state').fetchall():
+            user_id = self._user_of(kind, key)
+            last_update[user_id] = max(last_update.get(user_id, 0), updated_at)
+        # Changes not written yet are recent
+        for kind, key in list(self._pending):
+            last_update.pop(self._user_of(kind, key), None)
+        cutoff = time.time() - max_age
+        return {user_id for user_id, updated_at in last_update.items() if updated_at < cutoff}
+
+    async def _stage(self, kind, key, value):
+        """Queue a change and wait for the shared write of this persistence run."""
+        self._pending[(kind, key)] = value
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_pending())
+        await asyncio.shield(self._flush_task)
+
+    async def _flush_pending(self):
+        # Let every update_* call of the current run stage its change first
+        await asyncio.sleep(0)
+        batch, self._pending, self._flush_task = self._pending, {}, None
+        await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+
+    def _write(self, batch):
+        now = time.time()
+        with self._conn:
+            for (kind, key), value in batch.items():
+                if value is None:
+                    self._conn.execute('DELETE FROM state WHERE kind = ? AND key = ?', (kind, key))
+                else:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO state (kind, key, value, updated_at) VALUES (?, ?, ?, ?)',
+                        (kind, key, json.dumps(value, ensure_ascii=False), now)
+                    )
+        logger.debug("Persisted %s state changes", len(batch))
+
+    async def get_user_data(self):
+        return {int(key): LeadDraft(json.loads(value)) for key, value in self._load('user')}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {
+            tuple(json.loads(key)): json.loads(value)
+            for key, value in self._load(f'conversation:{name}')
+        }
+
+    async def update_conversation(self, name, key, new_state):
+        await self._stage(f'conversation:{name}', json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        await self._stage('user', str(user_id), data.to_dict() if data else None)
+
+    async def drop_user_data(self, user_id):
+        await self._stage('user', str(user_id), None)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            self._write(batch)
+        self._conn.close()
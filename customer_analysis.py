@@ -1,26 +1,269 @@
-import pandas as pd
-import numpy as np
-from datetime import datetime
-import matplotlib.pyplot as plt
-import seaborn as sns
-from pathlib import Path
-import arabic_reshaper
-from bidi.algorithm import get_display
+import argparse
+import heapq
+import json
+import os
+from dataclasses import asdict, dataclass, field
 import warnings
+from lead_snapshot import open_snapshot
+from lead_store import DATE_FORMAT, FIELD_NAMES, HEADER_BY_FIELD, LeadStore, ShardedLeadStore, open_store, shards_of
+from report_charts import render_charts
 warnings.filterwarnings('ignore')
 
+HOT_CUSTOMER_TYPE = 'عميل محتمل عالي'
+CATEGORY_COLUMNS = ['نوع العميل', 'نوع المنتج']
+RECENT_CUSTOMERS = 3
+STATE_FILE = 'analysis_state.json'
+# الأعمدة التي يحتاجها التحليل فقط
+ANALYSIS_FIELDS = ['created_at', 'username', 'customer_type', 'phone', 'email']
+
+
+@dataclass
+class AnalysisResult:
+    """نتائج التحليل الجاهزة للطباعة والرسم أو للإرسال عبر واجهة API"""
+    total: int = 0
+    customer_types: dict = field(default_factory=dict)
+    email_count: int = 0
+    phone_count: int = 0
+    daily_counts: dict = field(default_factory=dict)
+    hot_customers: list = field(default_factory=list)
+    recent_customers: list = field(default_factory=list)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def prepare_frame(df):
+    """تسمية الأعمدة بالعناوين العربية وتحديد أنواعها"""
+    import pandas as pd
+    df.columns = [HEADER_BY_FIELD.get(column, column) for column in df.columns]
+    if 'التاريخ' in df:
+        df['التاريخ'] = pd.to_datetime(df['التاريخ'], format=DATE_FORMAT, errors='coerce')
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def leads_to_frame(leads, with_id=False, fields=FIELD_NAMES):
+    """تحويل صفوف العملاء إلى DataFrame بأنواع أعمدة محددة"""
+    # pandas يُحمّل عند أول تحليل فقط، فاستيراد الوحدة نفسها سريع
+    import pandas as pd
+    columns = (['id'] if with_id else []) + list(fields)
+    return prepare_frame(pd.DataFrame.from_records(leads, columns=columns))
+
+
+def load_frame(store, fields=ANALYSIS_FIELDS, use_snapshot=True, since=None, until=None):
+    """تحميل أعمدة العملاء المطلوبة فقط، من اللقطة العمودية إن توفرت
+
+    عند تحديد فترة (since/until) تُقرأ أشهر اللقطة التي تتقاطع معها فقط.
+    """
+    if isinstance(store, ShardedLeadStore):
+        # كل مخزن فرعي يُحمّل بالتوازي (من لقطته إن توفرت) ثم تُدمج الجداول
+        import pandas as pd
+        frames = store.map(lambda shard: load_frame(shard, fields, use_snapshot, since, until))
+        return prepare_frame(pd.concat(frames, ignore_index=True))
+    snapshot = open_snapshot(store) if use_snapshot else None
+    if snapshot is not None:
+        return prepare_frame(snapshot.read(fields, since, until).to_pandas())
+    return leads_to_frame(store.query(since=since, until=until, fields=fields), fields=fields)
+
+
+def has_value(series):
+    """القيم غير الفارغة في عمود نصي"""
+    return series.notna() & series.astype(str).str.len().gt(0)
+
+
+def compute_metrics(df):
+    """حساب كل مؤشرات التقرير في مرور واحد على البيانات"""
+    if df.empty:
+        return AnalysisResult()
+
+    types = df['نوع العميل'].value_counts()
+    types = types[types > 0]
+
+    has_email = has_value(df['البريد الإلكتروني'])
+    has_phone = has_value(df['رقم الهاتف'])
+
+    daily = df['التاريخ'].dropna().dt.normalize().value_counts().sort_index()
+
+    hot = df.loc[df['نوع العميل'] == HOT_CUSTOMER_TYPE, ['اسم المستخدم', 'البريد الإلكتروني', 'رقم الهاتف']]
+    hot = hot.astype(object).where(hot.notna(), None)
+
+    recent = df.nlargest(RECENT_CUSTOMERS, 'التاريخ')[['اسم المستخدم', 'التاريخ', 'نوع العميل']]
+    recent = recent.astype(object).where(recent.notna(), None)
+
+    return AnalysisResult(
+        total=len(df),
+        customer_types={str(k): int(v) for k, v in types.items()},
+        email_count=int(has_email.sum()),
+        phone_count=int(has_phone.sum()),
+        daily_counts={k.date().isoformat(): int(v) for k, v in daily.items()},
+        hot_customers=[
+            {'username': u, 'email': e, 'phone': p}
+            for u, e, p in hot.itertuples(index=False, name=None)
+        ],
+        recent_customers=[
+            {'username': u, 'date': d.strftime('%Y-%m-%d'), 'customer_type': t}
+            for u, d, t in recent.itertuples(index=False, name=None)
+        ],
+    )
+
+
+class IncrementalAggregates:
+    """مؤشرات تراكمية محفوظة في ملف مع آخر تغيير تمت معالجته
+
+    كل تشغيل يعالج الصفوف المضافة أو المحدثة منذ التشغيل السابق ويضيفها إلى
+    العدادات المحفوظة بدلاً من إعادة حساب كل السجل. النسخ القديمة من العملاء
+    المحدثين (من سجل التعديلات) تُطرح من العدادات إن كانت قد حُسبت من قبل.
+    آخر تغيير تمت معالجته يُحفظ لكل مخزن فرعي (بوت) على حدة.
+    """
+
+    def __init__(self, state_file=STATE_FILE):
+        self.state_file = state_file
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.high_water_seq = {}
+        self.history_id = {}
+        self.total = 0
+        self.customer_types = {}
+        self.email_count = 0
+        self.phone_count = 0
+        self.daily_counts = {}
+        # [التاريخ, رقم الصف, اسم المستخدم, نوع العميل] لأحدث العملاء
+        self.recent = []
+        # أرقام صفوف المخزن المقسم مبنية على رقم كل بوت الثابت (MAX_SHARDS)
+        self.stable_shard_ids = True
+
+    def load(self):
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                state = json.load(f)
+            # الملفات القديمة تحفظ رقم آخر صف، وهو نفس رقم التغيير للصفوف المضافة فقط
+            state.setdefault('high_water_seq', state.pop('high_water_id', 0))
+            # وقبل تقسيم المخزن كان هناك رقم واحد للمخزن الوحيد
+            for key in ('high_water_seq', 'history_id'):
+                if not isinstance(state.get(key, {}), dict):
+                    state[key] = {'': state[key]}
+            # الملفات الأقدم لمخزن مقسم تحفظ أرقام صفوف بنظام الترقيم السابق
+            if set(state['high_water_seq']) - {''} and not state.get('stable_shard_ids'):
+                print("تغير ترقيم صفوف المخزن المقسم، سيتم إعادة الحساب")
+                return
+            self.__dict__.update({k: v for k, v in state.items() if k != 'state_file'})
+        except (OSError, ValueError) as e:
+            print(f"تعذر قراءة ملف المؤشرات المحفوظة، سيتم إعادة الحساب: {str(e)}")
+            self.reset()
+
+    def save(self):
+        state = {k: v for k, v in self.__dict__.items() if k != 'state_file'}
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
+
+    def update(self, store, chunk_size=50000):
+        """معالجة الصفوف المضافة أو المحدثة منذ آخر تشغيل فقط، وإرجاع عددها"""
+        if store.count() < self.total:
+            # المخزن أعيد إنشاؤه أو أزيل منه التكرار، نعيد الحساب من البداية
+            self.reset()
+        added = 0
+        for shard, shard_store in shards_of(store).items():
+            replaced = shard_store.replaced_since(self.history_id.get(shard, 0), fields=FIELD_NAMES)
+            if replaced:
+                self.history_id[shard] = replaced[-1]['history_id']
+            counted = [
+                dict(old, id=store.global_id(shard, old['row_id'])) for old in replaced
+                if old['seq'] <= self.high_water_seq.get(shard, 0)
+            ]
+            if counted:
+                self._add(leads_to_frame(counted, with_id=True), sign=-1)
+            for chunk in shard_store.iter_changes(self.high_water_seq.get(shard, 0), chunk_size, fields=FIELD_NAMES):
+                self.high_water_seq[shard] = chunk[-1]['seq']
+                for lead in chunk:
+                    lead['id'] = store.global_id(shard, lead['id'])
+                self._add(leads_to_frame(chunk, with_id=True))
+                added += len(chunk)
+        return added
+
+    @staticmethod
+    def _merge_counts(counts, changes, sign):
+        for key, count in changes:
+            value = counts.get(key, 0) + sign * int(count)
+            if value > 0:
+                counts[key] = value
+            else:
+                counts.pop(key, None)
+
+    def _add(self, df, sign=1):
+        """إضافة صفوف إلى العدادات، أو طرحها عندما sign = -1"""
+        self.total += sign * len(df)
+        self._merge_counts(self.customer_types, df['نوع العميل'].value_counts().items(), sign)
+        self.email_count += sign * int(has_value(df['البريد الإلكتروني']).sum())
+        self.phone_count += sign * int(has_value(df['رقم الهاتف']).sum())
+        days = df['التاريخ'].dropna().dt.normalize().value_counts()
+        self._merge_counts(self.daily_counts, ((day.date().isoformat(), count) for day, count in days.items()), sign)
+        # النسخة السابقة لعميل محدث لا تبقى ضمن أحدث العملاء
+        ids = set(df['id'].tolist())
+        self.recent = [r for r in self.recent if r[1] not in ids]
+        if sign < 0:
+            return
+        import pandas as pd
+        newest = df.nlargest(RECENT_CUSTOMERS, 'التاريخ')
+        candidates = [
+            [d.strftime(DATE_FORMAT), int(i), u, None if pd.isna(t) else t]
+            for i, d, u, t in newest[['id', 'التاريخ', 'اسم المستخدم', 'نوع العميل']].itertuples(index=False, name=None)
+        ]
+        self.recent = heapq.nlargest(RECENT_CUSTOMERS, self.recent + candidates, key=lambda r: (r[0], r[1]))
+
+    def to_result(self, store):
+        """بناء نتيجة التحليل من المؤشرات المحفوظة"""
+        hot = store.query(customer_type=HOT_CUSTOMER_TYPE, fields=['username', 'email', 'phone'])
+        return AnalysisResult(
+            total=self.total,
+            customer_types=dict(sorted(self.customer_types.items(), key=lambda item: -item[1])),
+            email_count=self.email_count,
+            phone_count=self.phone_count,
+            daily_counts=dict(sorted(self.daily_counts.items())),
+            hot_customers=[
+                {'username': lead['username'], 'email': lead['email'] or None, 'phone': lead['phone'] or None}
+                for lead in hot
+            ],
+            recent_customers=[
+                {'username': username, 'date': created_at[:10], 'customer_type': customer_type}
+                for created_at, _, username, customer_type in self.recent
+            ],
+        )
+
+
+def analyze_store(store=None, since=None, until=None):
+    """تحليل مخزن العملاء وإرجاع النتائج (للاستخدام من تطبيق الويب)"""
+    store = store if isinstance(store, LeadStore) else open_store(store)
+    return compute_metrics(load_frame(store, since=since, until=until))
+
+
 class CustomerAnalyzer:
-    def __init__(self, excel_file='customer_data.xlsx'):
-        self.excel_file = excel_file
+    def __init__(self, store=None, incremental=False, state_file=STATE_FILE, since=None, until=None):
+        # يمكن تمرير مخزن جاهز أو مسار ملف (قاعدة بيانات أو Excel)
+        self.store = store if isinstance(store, LeadStore) else open_store(store)
+        self.incremental = incremental
+        self.state_file = state_file
+        # فترة التقرير: العملاء المسجلون من since وحتى قبل until
+        self.since = since
+        self.until = until
         self.df = None
+        self.result = None
         self.load_data()
-        
+
     def load_data(self):
-        """تحميل البيانات من ملف Excel"""
+        """تحميل البيانات من مخزن العملاء"""
+        if self.incremental:
+            return self.load_incremental()
         try:
-            self.df = pd.read_excel(self.excel_file)
-            # حذف الأعمدة الفارغة
-            self.df = self.df.loc[:, ~self.df.columns.str.contains('^Unnamed')]
+            self.df = load_frame(self.store, since=self.since, until=self.until)
+            self.result = compute_metrics(self.df)
             print("\nالأعمدة المتاحة في الملف:")
             print(self.df.columns.tolist())
             print("\nتم تحميل البيانات بنجاح!")
@@ -28,148 +271,144 @@ class CustomerAnalyzer:
             print(f"حدث خطأ أثناء تحميل البيانات: {str(e)}")
             return None
 
+    def load_incremental(self):
+        """تحديث المؤشرات المحفوظة بالعملاء الجدد فقط"""
+        try:
+            aggregates = IncrementalAggregates(self.state_file)
+            added = aggregates.update(self.store)
+            aggregates.save()
+            self.result = aggregates.to_result(self.store)
+            print(f"\nتمت معالجة {added} عميل جديد (الإجمالي {aggregates.total})")
+        except Exception as e:
+            print(f"حدث خطأ أثناء تحديث المؤشرات: {str(e)}")
+            return None
+
     def analyze_customer_types(self):
         """تحليل أنواع العملاء"""
-        if self.df is None:
+        if self.result is None:
             return
-        
+
         try:
-            customer_types = self.df['نوع العميل'].value_counts()
+            customer_types = self.result.customer_types
             print("\nتحليل أنواع العملاء:")
             print("-------------------")
             for customer_type, count in customer_types.items():
                 print(f"{customer_type}: {count} عميل")
-            
-            # رسم بياني دائري
-            plt.figure(figsize=(10, 6))
-            plt.pie(customer_types.values, labels=customer_types.index, autopct='%1.1f%%')
-            plt.title('توزيع أنواع العملاء')
-            plt.savefig('customer_types.png')
-            plt.close()
-        except KeyError:
-            print("لم يتم العثور على عمود 'نوع العميل' في البيانات")
         except Exception as e:
             print(f"حدث خطأ أثناء تحليل أنواع العملاء: {str(e)}")
 
     def analyze_contact_info(self):
         """تحليل معلومات الاتصال"""
-        if self.df is None:
+        if self.result is None:
             return
-        
+
         try:
             print("\nتحليل معلومات الاتصال:")
             print("---------------------")
-            
+
             # تحليل البريد الإلكتروني
-            email_count = self.df['البريد الإلكتروني'].notna().sum()
+            email_count = self.result.email_count
             print(f"عدد العملاء الذين لديهم بريد إلكتروني: {email_count}")
-            
+
             # تحليل رقم الهاتف
-            phone_count = self.df['رقم الهاتف'].notna().sum()
+            phone_count = self.result.phone_count
             print(f"عدد العملاء الذين لديهم رقم هاتف: {phone_count}")
-            
-            # رسم بياني للمعلومات المتوفرة
-            contact_data = {
-                'بريد إلكتروني': email_count,
-                'رقم هاتف': phone_count
-            }
-            
-            plt.figure(figsize=(10, 6))
-            plt.bar(contact_data.keys(), contact_data.values())
-            plt.title('توفر معلومات الاتصال')
-            plt.ylabel('عدد العملاء')
-            plt.savefig('contact_info.png')
-            plt.close()
-            
+
         except Exception as e:
             print(f"حدث خطأ أثناء تحليل معلومات الاتصال: {str(e)}")
 
     def analyze_temporal_data(self):
         """تحليل البيانات الزمنية"""
-        if self.df is None:
+        if self.result is None:
             return
-        
+
         try:
-            # تحويل عمود التاريخ إلى datetime
-            self.df['التاريخ'] = pd.to_datetime(self.df['التاريخ'])
-            
-            # تحليل حسب اليوم
-            daily_counts = self.df['التاريخ'].dt.date.value_counts().sort_index()
-            
+            daily_counts = self.result.daily_counts
+
             print("\nتحليل البيانات الزمنية:")
             print("---------------------")
             print("عدد العملاء حسب اليوم:")
             for date, count in daily_counts.items():
                 print(f"{date}: {count} عميل")
-            
-            # رسم بياني للاتجاه الزمني
-            plt.figure(figsize=(12, 6))
-            plt.plot(daily_counts.index, daily_counts.values, marker='o')
-            plt.title('اتجاه تسجيل العملاء')
-            plt.xlabel('التاريخ')
-            plt.ylabel('عدد العملاء')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig('temporal_analysis.png')
-            plt.close()
-            
+
         except Exception as e:
             print(f"حدث خطأ أثناء تحليل البيانات الزمنية: {str(e)}")
 
     def generate_sales_recommendations(self):
         """توليد توصيات للمبيعات"""
-        if self.df is None:
+        if self.result is None:
             return
-        
+
         try:
             print("\nتوصيات المبيعات:")
             print("---------------")
-            
+
             # تحليل العملاء المحتملين العاليين
-            hot_customers = self.df[self.df['نوع العميل'] == 'عميل محتمل عالي']
-            if not hot_customers.empty:
+            if self.result.hot_customers:
                 print("\n1. العملاء المحتملين العاليين:")
-                for _, customer in hot_customers.iterrows():
-                    print(f"- {customer['اسم المستخدم']}")
-                    if pd.notna(customer['البريد الإلكتروني']):
-                        print(f"  البريد الإلكتروني: {customer['البريد الإلكتروني']}")
-                    if pd.notna(customer['رقم الهاتف']):
-                        print(f"  رقم الهاتف: {customer['رقم الهاتف']}")
-            
+                for customer in self.result.hot_customers:
+                    print(f"- {customer['username']}")
+                    if customer['email']:
+                        print(f"  البريد الإلكتروني: {customer['email']}")
+                    if customer['phone']:
+                        print(f"  رقم الهاتف: {customer['phone']}")
+
             # تحليل العملاء حسب نوع العميل
-            customer_types = self.df['نوع العميل'].value_counts()
             print("\n2. توزيع العملاء حسب النوع:")
-            for customer_type, count in customer_types.items():
+            for customer_type, count in self.result.customer_types.items():
                 print(f"- {customer_type}: {count} عميل")
-            
+
             # تحليل العملاء حسب التاريخ
-            recent_customers = self.df.sort_values('التاريخ', ascending=False).head(3)
             print("\n3. أحدث العملاء:")
-            for _, customer in recent_customers.iterrows():
-                print(f"- {customer['اسم المستخدم']} ({customer['التاريخ'].strftime('%Y-%m-%d')})")
-                print(f"  نوع العميل: {customer['نوع العميل']}")
-                
+            for customer in self.result.recent_customers:
+                print(f"- {customer['username']} ({customer['date']})")
+                print(f"  نوع العميل: {customer['customer_type']}")
+
         except Exception as e:
             print(f"حدث خطأ أثناء توليد توصيات المبيعات: {str(e)}")
 
+    def render_charts(self):
+        """رسم الرسوم البيانية التي تغيرت بياناتها"""
+        if self.result is None:
+            return
+
+        try:
+            rendered = render_charts(self.result)
+            if not rendered:
+                print("\nلم تتغير البيانات، الرسوم البيانية الحالية محدثة.")
+        except Exception as e:
+            print(f"حدث خطأ أثناء رسم الرسوم البيانية: {str(e)}")
+
     def generate_report(self):
         """توليد تقرير شامل"""
         print("\nتقرير تحليل العملاء")
         print("==================")
-        
+
         self.analyze_customer_types()
         self.analyze_contact_info()
         self.analyze_temporal_data()
         self.generate_sales_recommendations()
-        
+        self.render_charts()
+
         print("\nتم حفظ الرسوم البيانية في الملفات التالية:")
         print("- customer_types.png: توزيع أنواع العملاء")
         print("- contact_info.png: توفر معلومات الاتصال")
         print("- temporal_analysis.png: اتجاه تسجيل العملاء")
 
 def main():
-    analyzer = CustomerAnalyzer()
+    parser = argparse.ArgumentParser(description='تحليل بيانات العملاء')
+    parser.add_argument('--store', default=None, help='مسار مخزن العملاء (الافتراضي LEAD_STORE_PATH)')
+    parser.add_argument('--incremental', action='store_true', help='معالجة العملاء الجدد فقط منذ آخر تشغيل')
+    parser.add_argument('--state-file', default=STATE_FILE, help='ملف المؤشرات المحفوظة للوضع التراكمي')
+    parser.add_argument('--since', default=None, help='تحليل العملاء المسجلين من هذا التاريخ (YYYY-MM-DD)')
+    parser.add_argument('--until', default=None, help='وحتى قبل هذا التاريخ (YYYY-MM-DD)')
+    args = parser.parse_args()
+    if args.incremental and (args.since or args.until):
+        parser.error('الوضع التراكمي يحلل كل العملاء، لا يمكن تحديد فترة معه')
+
+    analyzer = CustomerAnalyzer(args.store, incremental=args.incremental, state_file=args.state_file,
+                                since=args.since, until=args.until)
     analyzer.generate_report()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
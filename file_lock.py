@@ -0,0 +1,110 @@
+"""Cross-process file locking and atomic file replacement.
+
+``FileLock`` is an advisory exclusive lock on a lock file (``fcntl.flock``
+on Linux/macOS, ``msvcrt.locking`` on Windows), used so that several bot
+processes, the web app and the command line tools can share the Excel
+workbook, the Arrow snapshot and the lead journals on one host.
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+POLL_INTERVAL = 0.05
+
+
+def _try_lock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Exclusive lock held on ``path`` between ``acquire`` and ``release``.
+
+    The lock file is created when needed and left in place, so every process
+    locks the same file. Threads sharing one ``FileLock`` also exclude each
+    other. Only code that takes the lock is kept out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._thread_lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=None):
+        """Take the lock, waiting for it unless ``blocking`` is False; returns
+        whether it was taken."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._thread_lock.acquire(blocking, -1 if timeout is None or not blocking else timeout):
+            return False
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                _try_lock(fd)
+            except OSError:
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    os.close(fd)
+                    self._thread_lock.release()
+                    return False
+                time.sleep(POLL_INTERVAL)
+                continue
+            self._fd = fd
+            return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            _unlock(fd)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def fsync_file(path):
+    """Flush ``path`` to disk."""
+    fd = os.open(path, os.O_RDONLY if fcntl is not None else os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_replace(path, write):
+    """Call ``write(tmp_path)`` and move the result over ``path`` in one step.
+
+    Readers see either the old file or the complete new one, and a crash
+    while writing leaves ``path`` untouched. The temporary file is in the
+    same directory so the rename does not cross file systems.
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        write(tmp_path)
+        fsync_file(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,210 @@
+"""Hot lead alerts for the sales team chat.
+
+The conversation handler queues every finished hot lead and returns; a
+background task on the bot's event loop sends them to the sales team chat
+as digest messages. A digest goes out once ``batch_size`` leads are waiting
+or ``flush_interval`` seconds after the first of them arrived, and carries
+every lead queued by then. During a campaign burst leads pile up while the
+previous digest waits for the outbound rate limiter, so a few digests
+cover hundreds of leads. Each digest lists the first ``MAX_LISTED``
+customers and counts the rest by product.
+"""
+import asyncio
+import logging
+from collections import Counter
+
+from telegram.constants import MessageLimit
+
+logger = logging.getLogger(__name__)
+
+MAX_LISTED = 15
+# Leads kept for a retry while the chat cannot be reached; older ones are dropped
+MAX_PENDING = 1000
+_STOP = object()
+
+
+def lead_key(lead):
+    """The same customer finishing twice shows once in a digest."""
+    return lead.get('user_id') or lead.get('phone') or lead.get('email') or id(lead)
+
+
+def format_lead(number, lead, repeats=1):
+    name = lead.get('username') or lead.get('user_id') or '-'
+    contact = ' — '.join(str(value) for value in (name, lead.get('phone'), lead.get('email')) if value)
+    details = '، '.join(lead[field] for field in ('product_type', 'budget', 'timeline') if lead.get(field))
+    company = lead.get('company_name')
+    if company and lead.get('company_size'):
+        company = f"{company} ({lead['company_size']})"
+    lines = [f"{number}. {contact}" + (f" (أكمل المحادثة {repeats} مرات)" if repeats > 1 else '')]
+    if details or company:
+        lines.append('   ' + ' — '.join(value for value in (details, company) if value))
+    return '\n'.join(lines)
+
+
+def format_digest(leads, max_listed=MAX_LISTED):
+    """Text of the digest for ``leads``, split into messages Telegram accepts."""
+    customers = {}
+    for lead in leads:
+        key = lead_key(lead)
+        repeats = customers.pop(key, (None, 0))[1]
+        # The latest answers win and the customer moves to the end
+        customers[key] = (lead, repeats + 1)
+    listed = list(customers.values())[:max_listed]
+    rest = list(customers.values())[max_listed:]
+
+    lines = [f"عملاء محتملون عاليون جدد: {len(customers)}"]
+    lines.extend(format_lead(number, lead, repeats) for number, (lead, repeats) in enumerate(listed, start=1))
+    if rest:
+        products = Counter(lead.get('product_type') or 'غير محدد' for lead, _ in rest)
+        lines.append(f"و {len(rest)} عميلاً آخر: " + '، '.join(f"{product} {count}"
+                                                             for product, count in products.most_common()))
+        lines.append("القائمة الكاملة في لوحة التحكم أو عبر lead_store.py export.")
+    return split_message(lines)
+
+
+def split_message(lines, limit=MessageLimit.MAX_TEXT_LENGTH):
+    """Join ``lines`` into as few messages of at most ``limit`` characters as possible."""
+    messages, current = [], ''
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = ''
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+class HotLeadAlerter:
+    """Background task sending queued hot leads to ``chat_id`` as digests.
+
+    Without a ``chat_id`` alerts are off and ``enqueue`` does nothing.
+    A digest that fails part way is retried from its first unsent message,
+    so the chat never gets the same message twice; ``stats`` counts the
+    leads, digests and messages sent and the failed attempts.
+    """
+
+    def __init__(self, chat_id, batch_size=50, flush_interval=60.0):
+        self.chat_id = chat_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {'leads': 0, 'digests': 0, 'messages': 0, 'failures': 0}
+        self._bot = None
+        self._queue = None
+        self._task = None
+        self._pending = []
+        # Messages of a digest that failed part way, and the leads they cover
+        self._unsent = []
+        self._unsent_leads = 0
+
+    def enqueue(self, lead):
+        """Queue a hot lead for the next digest."""
+        if self._queue is not None:
+            self._queue.put_nowait(lead)
+
+    def pending(self):
+        """Number of leads waiting for a digest."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._pending) + self._unsent_leads
+
+    async def start(self, bot):
+        """Start sending digests through ``bot`` on the running event loop."""
+        if self._task is not None or not self.chat_id:
+            return
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("Hot lead alerts to chat %s started (batch_size=%s, flush_interval=%ss)",
+                    self.chat_id, self.batch_size, self.flush_interval)
+
+    async def stop(self):
+        """Stop the background task and send what is still queued."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+        self._drain()
+        self._queue = None
+        while self.pending() and await self._send():
+            pass
+        if self.pending():
+            logger.error("Hot lead alerts stopped with %s leads not sent", self.pending())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            if not self._pending and not self._unsent:
+                lead = await self._queue.get()
+                if lead is _STOP:
+                    return
+                self._pending.append(lead)
+            deadline = loop.time() + self.flush_interval
+            while len(self._pending) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    lead = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if lead is _STOP:
+                    stopping = True
+                    break
+                self._pending.append(lead)
+            # Leads that arrived while the previous digest was being sent go in this one
+            stopping = self._drain() or stopping
+            if await self._send() or stopping:
+                continue
+            # Retry after flush_interval, or sooner if a lead or stop comes in
+            try:
+                lead = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+            except asyncio.TimeoutError:
+                continue
+            if lead is _STOP:
+                stopping = True
+            else:
+                self._pending.append(lead)
+
+    def _drain(self):
+        """Move queued leads to the pending ones; returns whether stop was requested."""
+        stopping = False
+        while self._queue is not None and not self._queue.empty():
+            lead = self._queue.get_nowait()
+            if lead is _STOP:
+                stopping = True
+            else:
+                self._pending.append(lead)
+        return stopping
+
+    async def _send(self):
+        """Send one digest, returning False if it failed.
+
+        The digest is the rest of one that failed part way, or else one of
+        every pending lead.
+        """
+        if not self._unsent:
+            if not self._pending:
+                return True
+            self._unsent = format_digest(self._pending)
+            self._unsent_leads = len(self._pending)
+            self._pending = []
+        try:
+            while self._unsent:
+                await self._bot.send_message(self.chat_id, self._unsent[0])
+                del self._unsent[0]
+                self.stats['messages'] += 1
+        except Exception as e:
+            self.stats['failures'] += 1
+            if len(self._pending) > MAX_PENDING:
+                logger.error("Dropping %s hot lead alerts, chat %s unreachable",
+                             len(self._pending) - MAX_PENDING, self.chat_id)
+                del self._pending[:len(self._pending) - MAX_PENDING]
+            logger.error("Error sending %s hot lead alerts, will retry: %s", self._unsent_leads, e)
+            return False
+        self.stats['leads'] += self._unsent_leads
+        self.stats['digests'] += 1
+        self._unsent_leads = 0
+        return True
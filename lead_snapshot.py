@@ -0,0 +1,456 @@
+"""Columnar snapshot of the lead store for the analyzer and bulk API reads.
+
+The leads are copied into Arrow IPC files next to the store
+(``customer_data.db.snapshot/``), partitioned by the month they were
+created in (``2025-01/``, leads without a date in ``undated/``). The
+manifest records every partition's files, row count, id range and date
+range, so reads bounded by date only open the months that overlap.
+
+A refresh only converts the leads added since the previous one and appends
+them as a new segment to their month; a month with more than
+``MAX_SEGMENTS`` segments is merged. When leads were updated or merged only
+the months that held their old versions are rewritten. Past months are
+merged into one segment, and months older than ``ARCHIVE_AFTER_MONTHS``
+into one compressed archive file that is still read the same way. Reads
+memory-map the files and select only the requested columns, so loading the
+analyzer's five columns does not read or decompress the rest of a segment.
+
+pyarrow is optional and only imported when a snapshot is first used:
+without it ``open_snapshot`` returns None and callers keep reading from the
+store.
+
+    python lead_snapshot.py                 # bring the snapshot up to date
+    python lead_snapshot.py --rebuild       # rebuild it from scratch
+    python lead_snapshot.py --list          # show the monthly partitions
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+
+from file_lock import FileLock
+from lead_store import DATE_FORMAT, FIELD_NAMES, format_date, open_store, shards_of
+
+# pyarrow is imported on first use, so starting the web app does not pay for it
+pa = pc = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+# Bumped when the file layout changes; older snapshots are rebuilt
+MANIFEST_FORMAT = 2
+MAX_SEGMENTS = 8
+# Months before the last ARCHIVE_AFTER_MONTHS are kept compressed
+ARCHIVE_AFTER_MONTHS = 3
+CHUNK_SIZE = 50000
+UNDATED = 'undated'
+# Few distinct values, stored dictionary encoded (categories in pandas)
+CATEGORY_FIELDS = ('customer_type', 'product_type')
+
+
+def available():
+    """Import pyarrow if it is installed; returns whether it is."""
+    global pa, pc
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.compute
+        except ImportError:
+            return False
+        pa, pc = pyarrow, pyarrow.compute
+    return True
+
+
+def snapshot_schema():
+    fields = [pa.field('id', pa.int64())]
+    for name in FIELD_NAMES:
+        if name == 'created_at':
+            type_ = pa.timestamp('s')
+        elif name == 'user_id':
+            type_ = pa.int64()
+        elif name in CATEGORY_FIELDS:
+            type_ = pa.dictionary(pa.int32(), pa.string())
+        else:
+            type_ = pa.string()
+        fields.append(pa.field(name, type_))
+    return pa.schema(fields)
+
+
+def parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_int(value):
+    try:
+        return None if value in (None, '') else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def leads_to_table(leads, schema):
+    """Convert lead dicts (with ``id``) to a table, one column at a time."""
+    arrays = []
+    for field in schema:
+        values = [lead.get(field.name) for lead in leads]
+        if field.name == 'created_at':
+            values = [parse_timestamp(value) for value in values]
+        elif pa.types.is_integer(field.type):
+            values = [parse_int(value) for value in values]
+        else:
+            # Excel cells can hold numbers, e.g. phone numbers
+            values = [None if value is None else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def month_key(moment, months_back=0):
+    """Partition name (``YYYY-MM``) of the month ``months_back`` before ``moment``."""
+    month = moment.year * 12 + moment.month - 1 - months_back
+    return f'{month // 12:04d}-{month % 12 + 1:02d}'
+
+
+def split_by_month(table):
+    """Yield ``(partition, rows)`` for every month with leads in ``table``."""
+    months = pc.fill_null(pc.strftime(table['created_at'], format='%Y-%m'), UNDATED)
+    for month in pc.unique(months).to_pylist():
+        yield month, table.filter(pc.equal(months, month))
+
+
+def archive_codec():
+    """Best compression this pyarrow build offers for archived months."""
+    for codec in ('zstd', 'lz4'):
+        if pa.Codec.is_available(codec):
+            return codec
+    return None
+
+
+class LeadSnapshot:
+    """Arrow files holding a copy of ``store`` up to change ``high_water_seq``,
+    one partition per month."""
+
+    def __init__(self, store, path=None, max_segments=MAX_SEGMENTS, archive_after=ARCHIVE_AFTER_MONTHS):
+        if not available():
+            raise ImportError('pyarrow is required for the lead snapshot')
+        self.store = store
+        self.path = path or store.path + '.snapshot'
+        self.max_segments = max_segments
+        # None keeps every month uncompressed
+        self.archive_after = archive_after
+        self.schema = snapshot_schema()
+        self.manifest = self._load_manifest()
+        self._store_version = None
+        self._segments = {}
+        self._lock = threading.Lock()
+        # Web workers and the command line refresh the same files
+        self._file_lock = FileLock(os.path.join(self.path, 'refresh.lock'))
+
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST_FILE)
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path(), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return self._empty_manifest()
+        if manifest.get('format') != MANIFEST_FORMAT:
+            # An older layout reads as empty until the next refresh rebuilds it
+            return dict(self._empty_manifest(), stale=True)
+        return manifest
+
+    @staticmethod
+    def _empty_manifest():
+        return {'format': MANIFEST_FORMAT, 'high_water_seq': 0, 'history_id': 0, 'rows': 0,
+                'partitions': {}, 'store_version': None}
+
+    def _save_manifest(self, manifest):
+        tmp_path = self._manifest_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _write_segment(self, table, partition, compress=False):
+        """Write ``table`` as one file of ``partition`` and return its name."""
+        table = table.unify_dictionaries().combine_chunks()
+        ids = table['id']
+        kind = 'archive' if compress else 'segment'
+        name = f'{partition}/{kind}-{pc.min(ids).as_py():012d}-{pc.max(ids).as_py():012d}.arrow'
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        options = pa.ipc.IpcWriteOptions(compression=archive_codec() if compress else None)
+        with pa.OSFile(path + '.tmp', 'wb') as sink, \
+                pa.ipc.new_file(sink, self.schema, options=options) as writer:
+            writer.write_table(table)
+        os.replace(path + '.tmp', path)
+        return name
+
+    def _segment(self, name):
+        table = self._segments.get(name)
+        if table is None:
+            # The table's buffers point into the mapped file, nothing is copied
+            # (archived months are decompressed on this first read)
+            source = pa.memory_map(os.path.join(self.path, name))
+            table = self._segments[name] = pa.ipc.open_file(source).read_all()
+        return table
+
+    def _clear(self):
+        # Top level segments are from snapshots before the monthly partitions
+        for pattern in ('*.arrow', os.path.join('*', '*.arrow')):
+            for path in glob.glob(os.path.join(self.path, pattern)):
+                os.remove(path)
+        self._segments.clear()
+        return self._empty_manifest()
+
+    def refresh(self, rebuild=False):
+        """Copy the leads added or changed since the last refresh; returns how many."""
+        with self._lock:
+            version = self.store.version()
+            if version == self._store_version and not rebuild:
+                return 0
+            os.makedirs(self.path, exist_ok=True)
+            with self._file_lock:
+                return self._refresh(version, rebuild)
+
+    def _refresh(self, version, rebuild):
+        # Another process may have advanced the snapshot in the meantime
+        manifest = self._load_manifest()
+        if manifest != self.manifest:
+            # and rewritten segments under names this process has mapped
+            self._segments.clear()
+        if manifest.get('store_version') == version and not rebuild:
+            self.manifest = manifest
+            self._store_version = version
+            return 0
+        if rebuild or manifest.get('stale') or self.store.count() < manifest['rows']:
+            # The store was replaced or shrunk (or the snapshot has an older
+            # layout), the files no longer match it
+            manifest = self._clear()
+        partitions = manifest['partitions']
+
+        # Rows whose version in the snapshot has since been replaced or merged
+        replaced = self.store.replaced_since(manifest['history_id'], fields=[])
+        if replaced:
+            manifest['history_id'] = replaced[-1]['history_id']
+        dropped = {old['row_id'] for old in replaced if old['seq'] <= manifest['high_water_seq']}
+        # Only months whose id range covers a replaced row can hold one
+        rewrite = {name for name, info in partitions.items()
+                   if dropped and info['min_id'] <= max(dropped) and info['max_id'] >= min(dropped)}
+
+        added = 0
+        tables = {}
+        for chunk in self.store.iter_changes(manifest['high_water_seq'], CHUNK_SIZE):
+            for partition, table in split_by_month(leads_to_table(chunk, self.schema)):
+                tables.setdefault(partition, []).append(table)
+            added += len(chunk)
+            manifest['high_water_seq'] = chunk[-1]['seq']
+
+        dropped_ids = pa.array(sorted(dropped), pa.int64())
+        for partition in sorted(rewrite | set(tables)):
+            if partition in rewrite:
+                # Changed leads come back in ``tables`` under their old id
+                self._rewrite(manifest, partition, tables.get(partition, ()), dropped_ids)
+                continue
+            info = partitions.setdefault(partition, {'segments': [], 'archived': False})
+            info['segments'].append(self._write_segment(pa.concat_tables(tables[partition]), partition))
+            info['archived'] = False
+            if len(info['segments']) > self.max_segments:
+                self._rewrite(manifest, partition)
+        rotated = self._rotate(manifest)
+        for partition in rewrite | set(tables) | rotated:
+            self._update_partition(manifest, partition)
+        manifest['rows'] = sum(info['rows'] for info in partitions.values())
+        if added or dropped:
+            logger.info("Snapshot at %s: %s leads added or changed, %s replaced",
+                        self.path, added, len(dropped))
+        manifest['store_version'] = version
+        self._save_manifest(manifest)
+
+        self.manifest = manifest
+        self._store_version = version
+        return added
+
+    def _rewrite(self, manifest, partition, tables=(), dropped=None, compress=None):
+        """Merge the files of ``partition``, without the ``dropped`` row ids, and
+        ``tables`` into one (compressed if ``compress``, by default as before)."""
+        info = manifest['partitions'][partition]
+        compress = info['archived'] if compress is None else compress
+        old = info['segments']
+        existing = [self._segment(name) for name in old]
+        kept = existing
+        if dropped is not None:
+            kept = [table.filter(pc.invert(pc.is_in(table['id'], dropped))) for table in kept]
+        unchanged = sum(t.num_rows for t in kept) == sum(t.num_rows for t in existing)
+        if not tables and unchanged and (len(old) <= 1 and compress == info['archived']):
+            return
+        merged = pa.concat_tables(kept + list(tables))
+        info['segments'] = [self._write_segment(merged.sort_by('id'), partition, compress)] if merged.num_rows else []
+        info['archived'] = compress
+        for old_name in old:
+            self._segments.pop(old_name, None)
+            if old_name not in info['segments']:
+                os.remove(os.path.join(self.path, old_name))
+
+    def _rotate(self, manifest):
+        """Merge each past month into one file, compressed once it is older than
+        ``archive_after`` months; returns the months that were rewritten."""
+        now = datetime.now()
+        current = month_key(now)
+        cutoff = None if self.archive_after is None else month_key(now, self.archive_after)
+        rotated = set()
+        for partition, info in manifest['partitions'].items():
+            if partition == UNDATED or partition >= current:
+                continue
+            archive = cutoff is not None and partition < cutoff
+            if len(info['segments']) > 1 or archive != info['archived']:
+                self._rewrite(manifest, partition, compress=archive)
+                rotated.add(partition)
+        return rotated
+
+    def _update_partition(self, manifest, partition):
+        """Record the row count, id range and date range of ``partition``."""
+        info = manifest['partitions'][partition]
+        if not info['segments']:
+            # Every lead of this month was changed into another one
+            del manifest['partitions'][partition]
+            shutil.rmtree(os.path.join(self.path, partition), ignore_errors=True)
+            return
+        table = pa.concat_tables([self._segment(name).select(['id', 'created_at'])
+                                  for name in info['segments']])
+        ids, dates = pc.min_max(table['id']), pc.min_max(table['created_at'])
+        info.update(
+            rows=table.num_rows,
+            min_id=ids['min'].as_py(),
+            max_id=ids['max'].as_py(),
+            min_created_at=format_date(dates['min'].as_py()),
+            max_created_at=format_date(dates['max'].as_py()),
+        )
+
+    def partitions(self, since=None, until=None):
+        """Names of the months that may hold leads created in [since, until)."""
+        since, until = format_date(since), format_date(until)
+        names = []
+        for name, info in sorted(self.manifest['partitions'].items()):
+            if since is not None or until is not None:
+                if info['min_created_at'] is None:
+                    continue
+                if since is not None and info['max_created_at'] < since:
+                    continue
+                if until is not None and info['min_created_at'] >= until:
+                    continue
+            names.append(name)
+        return names
+
+    def read(self, fields=None, since=None, until=None):
+        """Memory-mapped table with only ``fields`` (all of them, with ``id``, by
+        default) of the leads created in [since, until), ordered by id."""
+        columns = ['id'] + FIELD_NAMES if fields is None else list(fields)
+        bounded = since is not None or until is not None
+        read_columns = columns + [name for name in ('id', 'created_at')
+                                  if name not in columns and (name == 'id' or bounded)]
+        with self._lock:
+            names = [name for partition in self.partitions(since, until)
+                     for name in self.manifest['partitions'][partition]['segments']]
+            live = {name for info in self.manifest['partitions'].values() for name in info['segments']}
+            for name in set(self._segments) - live:
+                del self._segments[name]
+            tables = [self._segment(name).select(read_columns) for name in names]
+        if not tables:
+            return self.schema.empty_table().select(columns)
+        table = pa.concat_tables(tables)
+        if since is not None:
+            table = table.filter(pc.field('created_at') >= self._timestamp(since))
+        if until is not None:
+            table = table.filter(pc.field('created_at') < self._timestamp(until))
+        ids = table['id']
+        # Updated leads move to the month of their new date; only then is a
+        # copy needed to put the rows back in id order
+        if len(ids) > 1 and not pc.all(pc.less(ids.slice(0, len(ids) - 1), ids.slice(1))).as_py():
+            table = table.sort_by('id')
+        return table.select(columns)
+
+    def query(self, since=None, until=None, user_id=None, customer_type=None,
+              product_type=None, fields=None):
+        """Matching leads as dicts ordered by id, like ``LeadStore.query``."""
+        fields = ['id'] + FIELD_NAMES if fields is None else list(fields)
+        conditions = []
+        if user_id is not None:
+            conditions.append(pc.field('user_id') == int(user_id))
+        if customer_type is not None:
+            conditions.append(pc.field('customer_type') == customer_type)
+        if product_type is not None:
+            conditions.append(pc.field('product_type') == product_type)
+
+        filter_fields = [name for name, value in (('user_id', user_id), ('customer_type', customer_type),
+                                                   ('product_type', product_type)) if value is not None]
+        table = self.read(fields + [name for name in ['id'] + filter_fields if name not in fields],
+                          since, until)
+        for condition in conditions:
+            table = table.filter(condition)
+        table = table.select(fields)
+        if 'created_at' in fields:
+            index = fields.index('created_at')
+            table = table.set_column(index, 'created_at',
+                                     pc.strftime(table['created_at'], format=DATE_FORMAT))
+        return table.to_pylist()
+
+    @staticmethod
+    def _timestamp(value):
+        return pa.scalar(datetime.fromisoformat(format_date(value)), type=pa.timestamp('s'))
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def open_snapshot(store):
+    """The up-to-date snapshot of ``store``, or None when pyarrow is not installed."""
+    if not getattr(store, 'path', None) or not available():
+        return None
+    key = os.path.abspath(store.path)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None or snapshot.store is not store:
+            snapshot = _snapshots[key] = LeadSnapshot(store)
+    try:
+        snapshot.refresh()
+    except OSError as e:
+        # e.g. a read-only disk; the caller reads the store instead
+        logger.warning("Cannot update the snapshot at %s: %s", snapshot.path, e)
+        return None
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the columnar snapshot of the lead store')
+    parser.add_argument('--store', help='lead store path (default LEAD_STORE_PATH)')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the snapshot from scratch')
+    parser.add_argument('--archive-after', type=int, default=ARCHIVE_AFTER_MONTHS,
+                        help=f'compress months older than this many months (default {ARCHIVE_AFTER_MONTHS})')
+    parser.add_argument('--list', action='store_true', help='list the monthly partitions')
+    args = parser.parse_args()
+    if not available():
+        print("مكتبة pyarrow غير مثبتة. قم بتثبيتها باستخدام: pip install pyarrow")
+        return
+    # A sharded store has one snapshot per shard
+    for store in shards_of(open_store(args.store)).values():
+        snapshot = LeadSnapshot(store, archive_after=args.archive_after)
+        added = snapshot.refresh(rebuild=args.rebuild)
+        print(f"تمت إضافة {added} عميل إلى اللقطة ({snapshot.manifest['rows']} إجمالاً) في {snapshot.path}")
+        if args.list:
+            for name in snapshot.partitions():
+                info = snapshot.manifest['partitions'][name]
+                print(f"  {name}: {info['rows']} عميل، من {info['min_created_at'] or '-'} "
+                      f"إلى {info['max_created_at'] or '-'}" + (" (مؤرشف)" if info['archived'] else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,989 @@
+"""Lead storage backends shared by the bot, the web app and the analyzer.
+
+SQLite (in WAL mode) is the default engine: appends are a single indexed
+insert and queries only read the rows they ask for. The Excel backend is
+kept for existing ``customer_data.xlsx`` files, and ``export_to_excel``
+regenerates the workbook the sales team works with on demand. openpyxl is
+only imported when a workbook is read or written.
+
+    python lead_store.py export customer_data.xlsx
+    python lead_store.py export january.xlsx --since 2025-01-01 --until 2025-02-01
+    python lead_store.py import customer_data.xlsx
+    python lead_store.py dedupe
+    python lead_store.py export all_regions.xlsx      # every shard when BOT_SHARDS is set
+"""
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from operator import itemgetter
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from dotenv import load_dotenv
+
+from file_lock import FileLock, atomic_replace
+
+logger = logging.getLogger(__name__)
+
+# Every tool reading the store (web app, analyzer, snapshot, this CLI)
+# imports this module, so they all see the BOT_SHARDS and paths of .env
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (field name, Excel/API column header) in the order of the original workbook
+LEAD_FIELDS = [
+    ('created_at', 'التاريخ'),
+    ('username', 'اسم المستخدم'),
+    ('user_id', 'معرف المستخدم'),
+    ('customer_type', 'نوع العميل'),
+    ('phone', 'رقم الهاتف'),
+    ('email', 'البريد الإلكتروني'),
+    ('product_type', 'نوع المنتج'),
+    ('budget', 'الميزانية المتوقعة'),
+    ('timeline', 'موعد الشراء المتوقع'),
+    ('company_name', 'اسم الشركة'),
+    ('company_size', 'حجم الشركة'),
+    ('notes', 'ملاحظات إضافية'),
+]
+FIELD_NAMES = [name for name, _ in LEAD_FIELDS]
+HEADERS = [header for _, header in LEAD_FIELDS]
+HEADER_BY_FIELD = dict(LEAD_FIELDS)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_STORE_PATH = os.path.join(BASE_DIR, 'customer_data.db')
+# Leads read per query while exporting
+EXPORT_CHUNK_SIZE = 5000
+# Ids seen through a sharded store are ``row id * MAX_SHARDS + shard number``
+MAX_SHARDS = 64
+
+
+def format_date(value):
+    """Normalize a date bound or timestamp to the stored text format."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def to_record(lead, fields=None):
+    """Map a lead dict to the Arabic column headers used by Excel and the API."""
+    return {HEADER_BY_FIELD[name]: lead.get(name) for name in fields or FIELD_NAMES}
+
+
+ARABIC_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹', '01234567890123456789')
+# Numbers are compared on their last digits so that 0501234567, +966501234567
+# and 00966501234567 are the same phone
+PHONE_KEY_DIGITS = 9
+
+
+def normalize_phone(value):
+    """Key for duplicate detection: the last digits, ignoring spaces, signs and country code."""
+    if value is None:
+        return None
+    digits = ''.join(ch for ch in str(value).translate(ARABIC_DIGITS) if ch.isdigit())
+    return digits[-PHONE_KEY_DIGITS:] if len(digits) >= 7 else None
+
+
+def normalize_email(value):
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    return value if '@' in value else None
+
+
+def normalize_user_id(value):
+    try:
+        return None if value in (None, '') else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LeadIndex:
+    """In-memory map from Telegram user id, phone and email to a lead id.
+
+    A lead matches an existing one by user id first, then by phone, then by
+    email. ``seq`` is the last change the index has seen, so it can catch up
+    with rows written by other processes.
+    """
+
+    def __init__(self):
+        self.by_user = {}
+        self.by_phone = {}
+        self.by_email = {}
+        self.seq = 0
+
+    def keys(self, lead):
+        return (
+            (self.by_user, normalize_user_id(lead.get('user_id'))),
+            (self.by_phone, normalize_phone(lead.get('phone'))),
+            (self.by_email, normalize_email(lead.get('email'))),
+        )
+
+    def match(self, lead):
+        for table, key in self.keys(lead):
+            if key is not None and key in table:
+                return table[key]
+        return None
+
+    def add(self, lead_id, lead):
+        # A phone or email already known for another lead keeps pointing there
+        for table, key in self.keys(lead):
+            if key is not None:
+                table.setdefault(key, lead_id)
+
+
+class LeadStore:
+    """Base class for lead storage backends.
+
+    Leads are plain dicts keyed by ``FIELD_NAMES``; rows returned by
+    ``query`` also carry the row ``id``, which only grows.
+    """
+
+    def append(self, lead):
+        self.append_many([lead])
+
+    def append_many(self, leads):
+        raise NotImplementedError
+
+    def upsert_many(self, leads):
+        """Insert new leads and merge repeats of known ones, returning
+        ``(inserted, updated)``. Stores without history only append."""
+        self.append_many(leads)
+        return len(leads), 0
+
+    def query(self, since=None, until=None, user_id=None, customer_type=None,
+              product_type=None, after_id=None, limit=None, offset=None, fields=None):
+        """Return matching leads ordered by id."""
+        raise NotImplementedError
+
+    def iter_chunks(self, chunk_size=1000, **filters):
+        """Yield lists of up to ``chunk_size`` matching leads, paging by id."""
+        after_id = filters.pop('after_id', None)
+        fields = filters.pop('fields', None)
+        if fields is not None and 'id' not in fields:
+            fields = ['id'] + list(fields)
+        while True:
+            chunk = self.query(after_id=after_id, limit=chunk_size, fields=fields, **filters)
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                return
+            after_id = chunk[-1]['id']
+
+    def iter_changes(self, after_seq=0, chunk_size=1000, fields=None):
+        """Yield chunks of the leads added or changed after ``after_seq``, in
+        change order. Every lead carries its ``id`` and ``seq``.
+
+        Append-only stores use the row id as the sequence number.
+        """
+        for chunk in self.iter_chunks(chunk_size, after_id=after_seq, fields=fields):
+            for lead in chunk:
+                lead['seq'] = lead['id']
+            yield chunk
+
+    def replaced_since(self, after_history_id=0, fields=None):
+        """Earlier versions of leads replaced after ``after_history_id``.
+
+        Each carries ``history_id``, the surviving ``lead_id``, the ``row_id``
+        and ``seq`` the version was stored under, and the requested fields.
+        Readers that keep counts subtract the versions they had counted.
+        """
+        return []
+
+    def iter_leads(self, chunk_size=1000, **filters):
+        """Yield matching leads, reading ``chunk_size`` rows at a time."""
+        for chunk in self.iter_chunks(chunk_size, **filters):
+            yield from chunk
+
+    def count(self, **filters):
+        return len(self.query(**filters))
+
+    def aggregate(self, **filters):
+        """Count matching leads per day, customer type and product type."""
+        summary = {'total': 0, 'by_day': {}, 'by_customer_type': {}, 'by_product_type': {}}
+        for lead in self.iter_leads(fields=['created_at', 'customer_type', 'product_type'], **filters):
+            summary['total'] += 1
+            for bucket, value in (('by_day', (lead.get('created_at') or '')[:10]),
+                                  ('by_customer_type', lead.get('customer_type')),
+                                  ('by_product_type', lead.get('product_type'))):
+                value = value or ''
+                summary[bucket][value] = summary[bucket].get(value, 0) + 1
+        return summary
+
+    def version(self):
+        """Return a value that changes whenever the stored leads change."""
+        raise NotImplementedError
+
+    def global_id(self, shard, row_id):
+        """The id of row ``row_id`` of ``shard`` as seen through this store."""
+        return row_id
+
+    def close(self):
+        pass
+
+
+class SQLiteLeadStore(LeadStore):
+    """Leads in an SQLite database in WAL mode, indexed by date, user and type.
+
+    Every insert or update stamps the row with the next ``seq`` so readers can
+    follow changes, and ``upsert_many`` moves the version it replaces into
+    ``lead_history``. A ``read_only`` store opens the database with
+    ``mode=ro`` and changes nothing on disk, so it works on read-only file
+    systems; the database must exist.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._local = threading.local()
+        self._index = None
+        self._index_lock = threading.Lock()
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f'No lead store at {path}')
+        else:
+            self._setup()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(Path(self.path).resolve().as_uri() + '?mode=ro', uri=True, timeout=30)
+            else:
+                conn = sqlite3.connect(self.path, timeout=30)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _setup(self):
+        conn = self._connect()
+        columns = ', '.join(f'{name} TEXT' for name in FIELD_NAMES if name != 'user_id')
+        with conn:
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS leads ('
+                f'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, {columns}, seq INTEGER)'
+            )
+            if 'seq' not in [row['name'] for row in conn.execute('PRAGMA table_info(leads)')]:
+                # Databases from before upserts: rows were only appended, in id order
+                conn.execute('ALTER TABLE leads ADD COLUMN seq INTEGER')
+                conn.execute('UPDATE leads SET seq = id')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads (created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_leads_user_id ON leads (user_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_leads_customer_type ON leads (customer_type, created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_leads_product_type ON leads (product_type, created_at)')
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_seq ON leads (seq)')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS lead_history ('
+                f'history_id INTEGER PRIMARY KEY AUTOINCREMENT, lead_id INTEGER, row_id INTEGER, '
+                f'seq INTEGER, replaced_at TEXT, user_id INTEGER, {columns})'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_lead_history_lead_id ON lead_history (lead_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('seq', (SELECT COALESCE(MAX(seq), 0) FROM leads))"
+            )
+
+    @staticmethod
+    def _next_seq(conn, count=1):
+        """Reserve ``count`` sequence numbers and return the first one."""
+        conn.execute("UPDATE meta SET value = value + ? WHERE key = 'seq'", (count,))
+        return conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0] - count + 1
+
+    def append_many(self, leads):
+        if not leads:
+            return
+        conn = self._connect()
+        placeholders = ', '.join('?' for _ in FIELD_NAMES)
+        with conn:
+            first_seq = self._next_seq(conn, len(leads))
+            conn.executemany(
+                f'INSERT INTO leads ({", ".join(FIELD_NAMES)}, seq) VALUES ({placeholders}, ?)',
+                [[lead.get(name) for name in FIELD_NAMES] + [first_seq + i] for i, lead in enumerate(leads)]
+            )
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def _sync_index(self, conn):
+        """Load the lead index on first use, then add rows changed since it was last used."""
+        if self._index is None:
+            self._index = LeadIndex()
+        rows = conn.execute(
+            'SELECT id, seq, user_id, phone, email FROM leads WHERE seq > ? ORDER BY seq', (self._index.seq,)
+        )
+        for row in map(dict, rows):
+            self._index.add(row['id'], row)
+            self._index.seq = row['seq']
+
+    def _archive(self, conn, row_id, lead_id, replaced_at):
+        """Copy the current version of row ``row_id`` into the history of ``lead_id``."""
+        conn.execute(
+            f'INSERT INTO lead_history (lead_id, row_id, seq, replaced_at, {", ".join(FIELD_NAMES)}) '
+            f'SELECT ?, id, seq, ?, {", ".join(FIELD_NAMES)} FROM leads WHERE id = ?',
+            (lead_id, replaced_at, row_id)
+        )
+
+    def upsert_many(self, leads):
+        """Insert new leads and merge repeats of known ones, returning ``(inserted, updated)``.
+
+        A lead is a repeat when its Telegram user id, phone or email matches an
+        existing lead. The existing row keeps its id and takes the new values
+        (fields left empty keep the old ones); the replaced version is kept in
+        ``lead_history``. A row matched only by phone or email keeps its
+        Telegram user id, so another user's lead never takes it over.
+        """
+        if not leads:
+            return 0, 0
+        conn = self._connect()
+        inserted = updated = 0
+        placeholders = ', '.join('?' for _ in FIELD_NAMES)
+        assignments = ', '.join(f'{name} = COALESCE(?, {name})' for name in FIELD_NAMES)
+        replaced_at = datetime.now().strftime(DATE_FORMAT)
+        with self._index_lock:
+            try:
+                # Take the write lock before syncing so no other writer slips in between
+                conn.execute('BEGIN IMMEDIATE')
+                with conn:
+                    self._sync_index(conn)
+                    seq = self._next_seq(conn, len(leads))
+                    for lead in leads:
+                        values = [None if lead.get(name) == '' else lead.get(name) for name in FIELD_NAMES]
+                        lead_id = self._index.match(lead)
+                        row = self._owner_row(conn, lead_id)
+                        if lead_id is not None and row is None:
+                            # Another process merged the lead away (dedupe), reload the index
+                            self._index = None
+                            self._sync_index(conn)
+                            lead_id = self._index.match(lead)
+                            row = self._owner_row(conn, lead_id)
+                        owner = None if row is None else normalize_user_id(row['user_id'])
+                        user_id = normalize_user_id(lead.get('user_id'))
+                        if owner is not None and user_id is not None and owner != user_id:
+                            # Matched by phone or email only: the row stays with its own user
+                            lead = dict(lead, user_id=None)
+                            values[FIELD_NAMES.index('user_id')] = None
+                        if lead_id is None:
+                            lead_id = conn.execute(
+                                f'INSERT INTO leads ({", ".join(FIELD_NAMES)}, seq) VALUES ({placeholders}, ?)',
+                                values + [seq]
+                            ).lastrowid
+                            inserted += 1
+                        else:
+                            self._archive(conn, lead_id, lead_id, replaced_at)
+                            conn.execute(f'UPDATE leads SET {assignments}, seq = ? WHERE id = ?',
+                                         values + [seq, lead_id])
+                            updated += 1
+                        self._index.add(lead_id, lead)
+                        self._index.seq = seq
+                        seq += 1
+                    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            except Exception:
+                # The index may hold rows that were rolled back
+                self._index = None
+                raise
+        return inserted, updated
+
+    @staticmethod
+    def _owner_row(conn, lead_id):
+        """The ``user_id`` row of lead ``lead_id``, or None if it is gone."""
+        if lead_id is None:
+            return None
+        return conn.execute('SELECT user_id FROM leads WHERE id = ?', (lead_id,)).fetchone()
+
+    def deduplicate(self):
+        """Merge leads stored more than once before upserts existed.
+
+        Rows are visited in id order; a row matching an earlier lead is merged
+        into it (newer values win) and deleted, and both previous versions go
+        to ``lead_history``. Returns the number of rows merged.
+        """
+        conn = self._connect()
+        merged = 0
+        replaced_at = datetime.now().strftime(DATE_FORMAT)
+        assignments = ', '.join(f'{name} = COALESCE((SELECT {name} FROM leads WHERE id = :dup), {name})'
+                                for name in FIELD_NAMES)
+        with self._index_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            with conn:
+                index = LeadIndex()
+                rows = conn.execute('SELECT id, user_id, phone, email FROM leads ORDER BY id').fetchall()
+                for row in map(dict, rows):
+                    lead_id = index.match(row)
+                    if lead_id is None:
+                        index.add(row['id'], row)
+                        continue
+                    self._archive(conn, lead_id, lead_id, replaced_at)
+                    self._archive(conn, row['id'], lead_id, replaced_at)
+                    conn.execute(f'UPDATE leads SET {assignments}, seq = :seq WHERE id = :lead_id',
+                                 {'dup': row['id'], 'lead_id': lead_id, 'seq': self._next_seq(conn)})
+                    conn.execute('DELETE FROM leads WHERE id = ?', (row['id'],))
+                    index.add(lead_id, row)
+                    merged += 1
+                if merged:
+                    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            self._index = None
+        return merged
+
+    def history(self, lead_id):
+        """Earlier versions of a lead, oldest first."""
+        rows = self._connect().execute(
+            f'SELECT replaced_at, {", ".join(FIELD_NAMES)} FROM lead_history '
+            f'WHERE lead_id = ? ORDER BY history_id', (lead_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def iter_changes(self, after_seq=0, chunk_size=1000, fields=None):
+        columns = ['id', 'seq'] + [name for name in FIELD_NAMES if fields is None or name in fields]
+        conn = self._connect()
+        while True:
+            chunk = [dict(row) for row in conn.execute(
+                f'SELECT {", ".join(columns)} FROM leads WHERE seq > ? ORDER BY seq LIMIT ?',
+                (after_seq, chunk_size)
+            )]
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                return
+            after_seq = chunk[-1]['seq']
+
+    def replaced_since(self, after_history_id=0, fields=None):
+        columns = ['history_id', 'lead_id', 'row_id', 'seq'] + [
+            name for name in FIELD_NAMES if fields is None or name in fields
+        ]
+        rows = self._connect().execute(
+            f'SELECT {", ".join(columns)} FROM lead_history WHERE history_id > ? ORDER BY history_id',
+            (after_history_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def _where(self, since, until, user_id, customer_type, product_type, after_id):
+        clauses, params = [], []
+        if after_id is not None:
+            clauses.append('id > ?')
+            params.append(after_id)
+        if since is not None:
+            clauses.append('created_at >= ?')
+            params.append(format_date(since))
+        if until is not None:
+            clauses.append('created_at < ?')
+            params.append(format_date(until))
+        if user_id is not None:
+            clauses.append('user_id = ?')
+            params.append(user_id)
+        if customer_type is not None:
+            clauses.append('customer_type = ?')
+            params.append(customer_type)
+        if product_type is not None:
+            clauses.append('product_type = ?')
+            params.append(product_type)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, since=None, until=None, user_id=None, customer_type=None,
+              product_type=None, after_id=None, limit=None, offset=None, fields=None):
+        columns = ['id'] + FIELD_NAMES if fields is None else [f for f in fields if f == 'id' or f in FIELD_NAMES]
+        where, params = self._where(since, until, user_id, customer_type, product_type, after_id)
+        sql = f'SELECT {", ".join(columns)} FROM leads{where} ORDER BY id'
+        if limit is not None or offset is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([-1 if limit is None else limit, offset or 0])
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def count(self, since=None, until=None, user_id=None, customer_type=None,
+              product_type=None, after_id=None):
+        where, params = self._where(since, until, user_id, customer_type, product_type, after_id)
+        return self._connect().execute(f'SELECT COUNT(*) FROM leads{where}', params).fetchone()[0]
+
+    def aggregate(self, since=None, until=None, user_id=None, customer_type=None,
+                  product_type=None, after_id=None):
+        where, params = self._where(since, until, user_id, customer_type, product_type, after_id)
+        conn = self._connect()
+        summary = {'total': self.count(since, until, user_id, customer_type, product_type, after_id)}
+        for bucket, column in (('by_day', 'substr(created_at, 1, 10)'),
+                               ('by_customer_type', 'customer_type'),
+                               ('by_product_type', 'product_type')):
+            rows = conn.execute(
+                f'SELECT COALESCE({column}, \'\'), COUNT(*) FROM leads{where} GROUP BY 1 ORDER BY 1', params
+            )
+            summary[bucket] = dict(rows.fetchall())
+        return summary
+
+    def version(self):
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class ExcelLeadStore(LeadStore):
+    """Leads in a single Excel workbook (the original storage format).
+
+    Every append rewrites the workbook and every query reads all of it, so
+    this is only meant for existing files and small deployments. Writers
+    take a lock on ``<path>.lock`` for the whole load-modify-save, and the
+    new workbook replaces the old one in a single rename, so several
+    processes can append without losing rows and readers never see a
+    half-written file. A ``read_only`` store does not create a missing
+    workbook; reading it raises ``FileNotFoundError``.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self._lock = FileLock(path + '.lock')
+        if not read_only:
+            self.setup()
+
+    def setup(self):
+        if os.path.exists(self.path):
+            return
+        with self._lock:
+            if not os.path.exists(self.path):
+                from openpyxl import Workbook
+                wb = Workbook()
+                wb.active.append(HEADERS)
+                atomic_replace(self.path, wb.save)
+                logger.info("Created new Excel file at %s", self.path)
+
+    def append_many(self, leads):
+        if not leads:
+            return
+        self.setup()
+        import openpyxl
+        with self._lock:
+            wb = openpyxl.load_workbook(self.path)
+            ws = wb.active
+            for lead in leads:
+                ws.append([lead.get(name, '') for name in FIELD_NAMES])
+            atomic_replace(self.path, wb.save)
+
+    def _read(self):
+        import openpyxl
+        wb = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            rows = wb.active.iter_rows(min_row=2, values_only=True)
+            for row_id, row in enumerate(rows, start=1):
+                if not any(value is not None for value in row):
+                    continue
+                lead = dict(zip(FIELD_NAMES, row))
+                lead['id'] = row_id
+                lead['created_at'] = format_date(lead.get('created_at'))
+                yield lead
+        finally:
+            wb.close()
+
+    def query(self, since=None, until=None, user_id=None, customer_type=None,
+              product_type=None, after_id=None, limit=None, offset=None, fields=None):
+        since, until = format_date(since), format_date(until)
+        result = []
+        skip = offset or 0
+        for lead in self._read():
+            if after_id is not None and lead['id'] <= after_id:
+                continue
+            created_at = lead.get('created_at') or ''
+            if since is not None and created_at < since:
+                continue
+            if until is not None and created_at >= until:
+                continue
+            if user_id is not None and lead.get('user_id') != user_id:
+                continue
+            if customer_type is not None and lead.get('customer_type') != customer_type:
+                continue
+            if product_type is not None and lead.get('product_type') != product_type:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            if fields is not None:
+                lead = {name: lead.get(name) for name in fields}
+            result.append(lead)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def version(self):
+        stat = os.stat(self.path)
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+class ShardedLeadStore(LeadStore):
+    """Read-only view over the stores of several bots, queried in parallel.
+
+    Every bot (shard) writes to its own store; reports and the API read them
+    through this view instead of copying the rows into one store. Ids are
+    ``shard id * MAX_SHARDS + shard number``, so they are unique and
+    ``after_id`` paging works across shards. ``numbers`` gives each shard
+    its number (by default its position); ``open_store`` takes them from
+    ``shard_numbers`` so ids stay the same when BOT_SHARDS changes.
+    Changes are followed per shard, see ``shards_of``.
+    """
+
+    def __init__(self, shards, numbers=None):
+        self.shards = dict(shards)
+        self.names = list(self.shards)
+        self.numbers = dict(numbers) if numbers else {name: position for position, name in enumerate(self.names)}
+        numbers = [self.numbers[name] for name in self.names]
+        if len(set(numbers)) < len(numbers) or not all(0 <= number < MAX_SHARDS for number in numbers):
+            raise ValueError(f'Shards need distinct numbers below {MAX_SHARDS}: {self.numbers}')
+        self.path = None
+        self._pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='lead-shard')
+
+    def map(self, func):
+        """Call ``func(store)`` for every shard in parallel; returns the results in shard order."""
+        return list(self._pool.map(func, self.shards.values()))
+
+    def global_id(self, shard, row_id):
+        return row_id * MAX_SHARDS + self.numbers[shard]
+
+    def _each(self, method, after_id=None, **kwargs):
+        """Run ``method`` on every shard in parallel, ``after_id`` translated to its ids."""
+        def call(name):
+            number = self.numbers[name]
+            # Global ids above after_id are the local ids above (after_id - number) // MAX_SHARDS
+            local_after = None if after_id is None else (after_id - number) // MAX_SHARDS
+            return getattr(self.shards[name], method)(after_id=local_after, **kwargs)
+        return list(self._pool.map(call, self.names))
+
+    def append_many(self, leads):
+        raise NotImplementedError('Leads are written to a shard store, not to the sharded view')
+
+    def query(self, since=None, until=None, user_id=None, customer_type=None,
+              product_type=None, after_id=None, limit=None, offset=None, fields=None):
+        shard_fields = fields if fields is None or 'id' in fields else ['id'] + list(fields)
+        skip = offset or 0
+        results = self._each(
+            'query', after_id=after_id, since=since, until=until, user_id=user_id,
+            customer_type=customer_type, product_type=product_type,
+            # Any one shard may hold the whole page
+            limit=None if limit is None else skip + limit, fields=shard_fields,
+        )
+        for name, rows in zip(self.names, results):
+            for row in rows:
+                row['id'] = self.global_id(name, row['id'])
+        merged = heapq.merge(*results, key=itemgetter('id'))
+        leads = list(itertools.islice(merged, skip, None if limit is None else skip + limit))
+        if shard_fields is not fields:
+            for lead in leads:
+                del lead['id']
+        return leads
+
+    def count(self, **filters):
+        return sum(self._each('count', **filters))
+
+    def aggregate(self, **filters):
+        summary = {'total': 0, 'by_day': {}, 'by_customer_type': {}, 'by_product_type': {}}
+        for shard_summary in self._each('aggregate', **filters):
+            summary['total'] += shard_summary['total']
+            for bucket in ('by_day', 'by_customer_type', 'by_product_type'):
+                counts = summary[bucket]
+                for key, count in shard_summary[bucket].items():
+                    counts[key] = counts.get(key, 0) + count
+        for bucket in ('by_day', 'by_customer_type', 'by_product_type'):
+            summary[bucket] = dict(sorted(summary[bucket].items()))
+        return summary
+
+    def iter_changes(self, after_seq=0, chunk_size=1000, fields=None):
+        raise NotImplementedError('Changes are followed per shard, see shards_of()')
+
+    def replaced_since(self, after_history_id=0, fields=None):
+        raise NotImplementedError('Changes are followed per shard, see shards_of()')
+
+    def version(self):
+        return '|'.join(str(version) for version in self.map(lambda store: store.version()))
+
+    def close(self):
+        self.map(lambda store: store.close())
+        self._pool.shutdown()
+
+
+def shards_of(store):
+    """``{shard name: store}`` for the shards of ``store``; a single store is shard ``''``."""
+    return getattr(store, 'shards', None) or {'': store}
+
+
+def shard_names():
+    """The shards listed in BOT_SHARDS (e.g. ``riyadh,jeddah``), empty when not sharded."""
+    return [name.strip() for name in os.environ.get('BOT_SHARDS', '').split(',') if name.strip()]
+
+
+def shard_path(path, shard):
+    """``customer_data.db`` becomes ``customer_data.riyadh.db`` for shard ``riyadh``."""
+    if not shard:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.{shard}{ext}'
+
+
+def store_path(shard=''):
+    """Store path of ``shard``: ``LEAD_STORE_PATH_<SHARD>`` or ``LEAD_STORE_PATH`` with the shard name."""
+    if shard and os.environ.get(f'LEAD_STORE_PATH_{shard.upper()}'):
+        return os.environ[f'LEAD_STORE_PATH_{shard.upper()}']
+    return shard_path(os.environ.get('LEAD_STORE_PATH', DEFAULT_STORE_PATH), shard)
+
+
+def shard_registry_path():
+    """``customer_data.shards.json`` next to the store in LEAD_STORE_PATH."""
+    return os.path.splitext(store_path())[0] + '.shards.json'
+
+
+def read_shard_registry(path=None):
+    """The registered ``{shard name: number}``, empty when no shard was opened yet."""
+    try:
+        with open(path or shard_registry_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def shard_numbers(names, path=None, register=True):
+    """``{shard name: number}`` for ``names``, from the registry at ``path``.
+
+    A shard gets the next free number the first time it is opened and keeps
+    it, so adding, removing or reordering shards in BOT_SHARDS does not
+    change the ids of leads already stored. Without ``register`` (on a
+    read-only disk) shards missing from the registry get a free number for
+    this process only.
+    """
+    path = path or shard_registry_path()
+    if not register:
+        numbers = read_shard_registry(path)
+        new = [name for name in names if name not in numbers]
+        if new:
+            logger.warning("Shards %s are not in %s yet, their ids may change", ', '.join(new), path)
+        for name in new:
+            numbers[name] = max(numbers.values(), default=-1) + 1
+        return {name: numbers[name] for name in names}
+    with FileLock(path + '.lock'):
+        numbers = read_shard_registry(path)
+        new = [name for name in names if name not in numbers]
+        for name in new:
+            numbers[name] = max(numbers.values(), default=-1) + 1
+            if numbers[name] >= MAX_SHARDS:
+                raise ValueError(f'At most {MAX_SHARDS} shards can be registered in {path}')
+        if new:
+            def write(tmp_path):
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(numbers, f, ensure_ascii=False, indent=2)
+            atomic_replace(path, write)
+    return {name: numbers[name] for name in names}
+
+
+def open_store(path=None, read_only=False):
+    """Open the lead store at ``path`` (or ``LEAD_STORE_PATH``), picking the
+    backend from the file extension. Without a path and with BOT_SHARDS set,
+    returns a ``ShardedLeadStore`` over the stores of all the bots.
+
+    A new SQLite store starts with the leads of the workbook of the same
+    name (``customer_data.xlsx`` for the default store), which deployments
+    kept their leads in before. ``read_only`` stores (the web app's) create
+    and change nothing, and read that workbook while the database does not
+    exist yet.
+    """
+    if not path and shard_names():
+        names = shard_names()
+        return ShardedLeadStore({name: open_store(store_path(name), read_only) for name in names},
+                                shard_numbers(names, register=not read_only))
+    path = path or store_path()
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        return ExcelLeadStore(path, read_only)
+    workbook = os.path.splitext(path)[0] + '.xlsx'
+    if os.path.exists(path) or not os.path.exists(workbook):
+        return SQLiteLeadStore(path, read_only)
+    if read_only:
+        return ExcelLeadStore(workbook, read_only=True)
+    with FileLock(path + '.lock'):
+        # Another process may have created and filled it meanwhile
+        new = not os.path.exists(path)
+        store = SQLiteLeadStore(path)
+        if new:
+            logger.info("Creating %s from the leads in %s", path, workbook)
+            import_from_excel(store, workbook)
+    return store
+
+
+def write_excel(leads, output, fields=None):
+    """Write ``leads`` as a workbook to ``output`` (a path or a binary file);
+    returns the number of rows.
+
+    The workbook is in openpyxl's write-only mode: each row is serialized to
+    a temporary file as it is appended instead of being kept as cells, so
+    memory stays flat however many leads ``leads`` yields.
+    """
+    from openpyxl import Workbook
+    fields = fields or FIELD_NAMES
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append([HEADER_BY_FIELD[name] for name in fields])
+    rows = 0
+    for lead in leads:
+        ws.append([lead.get(name) for name in fields])
+        rows += 1
+    wb.save(output)
+    return rows
+
+
+SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+DOCUMENT_RELATIONSHIPS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# The parts of a one-sheet workbook besides the sheet itself
+WORKBOOK_PARTS = {
+    '[Content_Types].xml': (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        f'<Relationships xmlns="{RELATIONSHIPS_NS}">'
+        f'<Relationship Id="rId1" Type="{DOCUMENT_RELATIONSHIPS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        f'<workbook xmlns="{SPREADSHEET_NS}" xmlns:r="{DOCUMENT_RELATIONSHIPS}">'
+        '<sheets><sheet name="Sheet" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        f'<Relationships xmlns="{RELATIONSHIPS_NS}">'
+        f'<Relationship Id="rId1" Type="{DOCUMENT_RELATIONSHIPS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{DOCUMENT_RELATIONSHIPS}/styles" Target="styles.xml"/>'
+        '</Relationships>'),
+    'xl/styles.xml': (
+        f'<styleSheet xmlns="{SPREADSHEET_NS}">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'),
+}
+
+# Control characters XML 1.0 does not allow, even escaped
+ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def column_letter(index):
+    """Excel column name of the zero-based ``index`` (0 -> A, 26 -> AA)."""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def sheet_cell(ref, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        text = escape(ILLEGAL_XML_CHARS.sub('', str(value)))
+        return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+    return f'<c r="{ref}"><v>{value}</v></c>'
+
+
+def sheet_row(number, columns, values):
+    cells = ''.join(sheet_cell(f'{column}{number}', value)
+                    for column, value in zip(columns, values) if value is not None)
+    return f'<row r="{number}">{cells}</row>'
+
+
+def stream_excel(leads, output, fields=None):
+    """Write ``leads`` as a workbook to the binary file ``output``, which may
+    be unseekable; returns the number of rows.
+
+    Unlike :func:`write_excel` the sheet is written straight into its zip
+    entry as each lead arrives, so the start of the file reaches ``output``
+    before the last lead is read.
+    """
+    fields = fields or FIELD_NAMES
+    columns = [column_letter(i) for i in range(len(fields))]
+    rows = 0
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, part in WORKBOOK_PARTS.items():
+            zf.writestr(name, XML_DECLARATION + part)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(f'{XML_DECLARATION}<worksheet xmlns="{SPREADSHEET_NS}"><sheetData>'.encode('utf-8'))
+            sheet.write(sheet_row(1, columns, [HEADER_BY_FIELD[name] for name in fields]).encode('utf-8'))
+            output.flush()
+            for lead in leads:
+                rows += 1
+                sheet.write(sheet_row(rows + 1, columns, [lead.get(name) for name in fields]).encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+    return rows
+
+
+def export_to_excel(store, path, chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    """Write the matching leads to an Excel workbook at ``path``, reading
+    ``chunk_size`` leads at a time."""
+    rows = []
+    atomic_replace(path, lambda tmp_path: rows.append(
+        write_excel(store.iter_leads(chunk_size=chunk_size, **filters), tmp_path)))
+    logger.info("Exported %s leads to %s", rows[0], path)
+    return rows[0]
+
+
+def import_from_excel(store, path):
+    """Add the leads of an existing workbook to ``store``, merging repeats of
+    the same customer. Returns ``(inserted, updated)``."""
+    leads = ExcelLeadStore(path, read_only=True).query()
+    for lead in leads:
+        lead.pop('id', None)
+    inserted, updated = store.upsert_many(leads)
+    logger.info("Imported %s leads from %s (%s new, %s merged)", len(leads), path, inserted, updated)
+    return inserted, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='أدوات مخزن بيانات العملاء')
+    parser.add_argument('command', choices=['export', 'import', 'dedupe'])
+    parser.add_argument('excel_file', nargs='?', default=os.path.join(BASE_DIR, 'customer_data.xlsx'))
+    parser.add_argument('--store', default=None, help='مسار قاعدة البيانات (الافتراضي LEAD_STORE_PATH)')
+    parser.add_argument('--shard', default=None, help='مخزن أحد البوتات في BOT_SHARDS فقط')
+    parser.add_argument('--since', default=None, help='تصدير العملاء المسجلين من هذا التاريخ (YYYY-MM-DD)')
+    parser.add_argument('--until', default=None, help='وحتى قبل هذا التاريخ (YYYY-MM-DD)')
+    parser.add_argument('--customer-type', default=None, help='تصدير هذا النوع من العملاء فقط')
+    parser.add_argument('--product-type', default=None, help='تصدير المهتمين بهذا المنتج فقط')
+    args = parser.parse_args()
+    filters = {name: getattr(args, name) for name in ('since', 'until', 'customer_type', 'product_type')
+               if getattr(args, name)}
+
+    store = open_store(args.store or (store_path(args.shard) if args.shard else None))
+    if args.command == 'export':
+        rows = export_to_excel(store, args.excel_file, **filters)
+        print(f"تم تصدير {rows} عميل إلى {args.excel_file}")
+    elif args.command == 'import':
+        if isinstance(store, ShardedLeadStore):
+            print(f"حدد البوت الذي سيتم الاستيراد إلى مخزنه باستخدام --shard ({', '.join(store.names)})")
+            return
+        inserted, updated = import_from_excel(store, args.excel_file)
+        print(f"تم استيراد {inserted} عميل جديد من {args.excel_file} ودمج {updated} عميل مكرر")
+    else:
+        for name, shard in shards_of(store).items():
+            if not isinstance(shard, SQLiteLeadStore):
+                print(f"إزالة التكرار متاحة لقاعدة بيانات SQLite فقط ({shard.path})")
+                continue
+            merged = shard.deduplicate()
+            print(f"تم دمج {merged} عميل مكرر" + (f" في مخزن {name}" if name else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+import asyncio
+import contextlib
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def read_journal(path):
+    """All the leads in the journal at ``path`` and how many of them were saved."""
+    leads, done = [], 0
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash mid-write
+                    continue
+                if 'done' in record:
+                    done = record['done']
+                else:
+                    leads.append(record['lead'])
+    except FileNotFoundError:
+        pass
+    return leads, done
+
+
+class LeadJournal:
+    """Append-only file of the leads a writer accepted but has not saved yet.
+
+    The writer appends the leads queued since its last write in one go,
+    with one fsync for all of them, and a ``done`` marker follows once a
+    batch is in the store; the file is emptied whenever everything is
+    saved. Each process has its own journal in ``directory`` and holds a
+    lock on it while running, so at startup the journals of processes that
+    crashed can be told apart from live ones and their leads taken over.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, f'{socket.gethostname()}-{os.getpid()}.jsonl')
+        self._lock = FileLock(self.path + '.lock')
+        self._file = None
+        self._records = 0
+        self._done = 0
+        # The writer appends new leads while a store write marks older ones done
+        self._mutex = threading.Lock()
+
+    def open(self):
+        """Start this process's journal; returns the unsaved leads of earlier processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock.acquire()
+        # A restarted container can get the pid, and so the journal, of its previous run
+        leads, self._done = read_journal(self.path)
+        self._records = len(leads)
+        recovered = leads[self._done:]
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self._file.tell():
+            # End a line a crash may have torn
+            self._write(['\n'])
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.jsonl'))):
+            if path == self.path:
+                continue
+            lock = FileLock(path + '.lock')
+            if not lock.acquire(blocking=False):
+                # Its process is still running
+                continue
+            try:
+                leads, done = read_journal(path)
+                leads = leads[done:]
+                # Journal them here before the old file goes
+                self.append_many(leads)
+                recovered.extend(leads)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            finally:
+                lock.release()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path + '.lock')
+        return recovered
+
+    def _write(self, lines):
+        self._file.write(''.join(lines))
+        self._file.flush()
+
+    def append_many(self, leads):
+        if not leads:
+            return
+        with self._mutex:
+            self._write(json.dumps({'lead': lead}, ensure_ascii=False) + '\n' for lead in leads)
+            os.fsync(self._file.fileno())
+            self._records += len(leads)
+
+    def commit(self, count):
+        """Mark the oldest ``count`` unsaved leads as saved."""
+        with self._mutex:
+            self._done += count
+            if self._done >= self._records:
+                self._file.seek(0)
+                self._file.truncate()
+                self._records = self._done = 0
+            else:
+                # Not fsynced: losing a marker only means saving those leads again,
+                # and the store merges repeats of a lead
+                self._write([json.dumps({'done': self._done}) + '\n'])
+
+    def close(self):
+        """Close the journal, removing it when nothing is left unsaved."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        saved = self._done >= self._records
+        if saved:
+            os.remove(self.path)
+        else:
+            logger.error("%s unsaved leads kept in %s", self._records - self._done, self.path)
+        self._lock.release()
+        if saved:
+            with contextlib.suppress(OSError):
+                os.remove(self.path + '.lock')
+
+
+class LeadWriter:
+    """Write-behind sink that persists finished leads in batches.
+
+    Handlers call ``enqueue`` and get back a future; a background task
+    collects the queued rows and hands them to ``flush_func`` in a worker
+    thread once ``batch_size`` rows are waiting or ``flush_interval``
+    seconds have passed since the first one arrived.
+
+    With a ``journal`` a second task writes every row waiting in the queue
+    to it in a worker thread, with one fsync for all of them (group
+    commit), and resolves their futures once they are on disk; only
+    journaled rows are flushed. It keeps journaling while a store write is
+    running, so a handler awaiting its future never waits for the store,
+    and a lead acknowledged to the customer survives a crash: the next
+    start of any writer using the same journal directory saves it.
+    """
+
+    def __init__(self, flush_func, batch_size=50, flush_interval=2.0, journal=None):
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self._queue = None
+        self._task = None
+        self._journal_task = None
+        self._arrived = None
+        self._stopping = False
+        self._journaling = 0
+        self._pending = []
+
+    def enqueue(self, row):
+        """Queue a lead row for the next batch.
+
+        Returns a future that is done once the row is in the journal (or
+        queued, without one), or None when the writer is not running and
+        the row was written straight away.
+        """
+        if self._queue is None:
+            # Writer not running (e.g. used from a script), write straight away
+            self.flush_func([row])
+            return None
+        durable = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((row, durable))
+        return durable
+
+    def pending(self):
+        """Number of rows queued or waiting to be written."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + self._journaling + len(self._pending)
+
+    async def start(self):
+        """Start the background writer on the running event loop."""
+        if self._task is not None:
+            return
+        if self.journal is not None:
+            recovered = self.journal.open()
+            if recovered:
+                logger.warning("Recovered %s unsaved leads from the journal", len(recovered))
+                self._pending.extend(recovered)
+        self._queue = asyncio.Queue()
+        self._arrived = asyncio.Event()
+        self._stopping = False
+        loop = asyncio.get_running_loop()
+        self._journal_task = loop.create_task(self._receive())
+        self._task = loop.create_task(self._run())
+        logger.info("Lead writer started (batch_size=%s, flush_interval=%ss)",
+                    self.batch_size, self.flush_interval)
+
+    async def stop(self):
+        """Stop the background writer and flush everything still queued."""
+        if self._task is None:
+            return
+        # Let a flush that is already running in the worker thread finish
+        # rather than cancelling it and writing the same rows twice
+        self._queue.put_nowait(_STOP)
+        await self._journal_task
+        await self._task
+        self._task = self._journal_task = None
+        await self._accept(self._drain())
+        while self._pending and await self._flush():
+            pass
+        self._queue = None
+        if self.journal is not None:
+            self.journal.close()
+        if self._pending:
+            logger.error("Lead writer stopped with %s unsaved leads", len(self._pending))
+        else:
+            logger.info("Lead writer stopped, all leads saved")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            if not self._pending:
+                await self._wait_for_rows()
+                continue
+            deadline = loop.time() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._stopping:
+                timeout = deadline - loop.time()
+                if timeout <= 0 or not await self._wait_for_rows(timeout):
+                    break
+            if not await self._flush() and not self._stopping:
+                await asyncio.sleep(self.flush_interval)
+
+    async def _wait_for_rows(self, timeout=None):
+        """Wait until more rows are journaled or stop is requested; False on timeout."""
+        self._arrived.clear()
+        try:
+            await asyncio.wait_for(self._arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _receive(self):
+        """Journal queued rows as they come, all rows waiting at once, until stopped."""
+        while not self._stopping:
+            await self._accept([await self._queue.get()] + self._drain())
+
+    async def _accept(self, items):
+        if any(item is _STOP for item in items):
+            self._stopping = True
+        await self._journal([item for item in items if item is not _STOP])
+        self._arrived.set()
+
+    def _drain(self):
+        items = []
+        while self._queue is not None and not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    async def _journal(self, items):
+        """Write the rows of ``items`` to the journal with one fsync, off the
+        event loop, then acknowledge them and make them eligible for flushing."""
+        rows = [row for row, _ in items]
+        if self.journal is not None and rows:
+            self._journaling = len(rows)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.journal.append_many, rows)
+            except Exception as e:
+                # Still save them, they are only missing the crash protection
+                logger.error("Error journaling %s leads: %s", len(rows), e)
+            finally:
+                self._journaling = 0
+        self._pending.extend(rows)
+        for _, durable in items:
+            if not durable.done():
+                durable.set_result(None)
+
+    async def _flush(self):
+        """Write one batch of pending rows, returning False if it failed."""
+        if not self._pending:
+            return True
+        batch = self._pending[:self.batch_size]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._save, batch)
+        except Exception as e:
+            # Keep the rows and try again on the next cycle
+            logger.error("Error saving %s leads, will retry: %s", len(batch), e)
+            return False
+        del self._pending[:len(batch)]
+        return True
+
+    def _save(self, batch):
+        self.flush_func(batch)
+        if self.journal is not None:
+            self.journal.commit(len(batch))
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+from telegram.error import BadRequest, Forbidden, InvalidToken, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Bot API methods whose repeat would post, edit or answer twice
+NON_IDEMPOTENT_PREFIXES = ('send', 'edit', 'answer', 'forward', 'copy')
+
+
+def request_not_sent(error):
+    """True if ``error`` happened before the request could reach Telegram."""
+    return isinstance(error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class TokenBucket:
+    """Token bucket that hands out send slots in arrival order.
+
+    ``reserve`` takes a token immediately, letting the balance go negative,
+    and returns how long the caller has to wait for it. Waiting callers are
+    therefore spaced out at ``rate`` per second instead of polling.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self):
+        """True once the bucket has refilled completely."""
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Smooths and retries outbound Bot API calls.
+
+    Every call waits for a slot in the global bucket (Telegram allows about
+    30 messages per second per bot) and, when it targets a chat, in that
+    chat's bucket (about one message per second in private chats, with
+    short bursts of ``chat_burst``, and 20 per minute in groups). Calls
+    that fail with ``RetryAfter`` wait the time Telegram asks for; network
+    errors are retried with jittered exponential backoff. Sending, editing
+    and answering calls are only retried if the connection failed before
+    the request went out, since after a timeout Telegram may already have
+    acted on it. Calls that still fail after ``max_retries`` are counted
+    as drops and the error is raised to the caller.
+    """
+
+    def __init__(self, overall_rate=30, private_chat_rate=1, group_rate=20 / 60, chat_burst=3,
+                 max_retries=5, base_delay=0.5, max_delay=30):
+        self.overall = TokenBucket(overall_rate, overall_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._chats = {}
+        self.stats = {'sent': 0, 'retries': 0, 'drops': 0, 'queue_depth': 0}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Forget chats that have not sent anything for a while
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle()}
+            # Negative ids are groups and channels
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.private_chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_slot(self, chat_id):
+        self.stats['queue_depth'] += 1
+        try:
+            if chat_id is not None:
+                delay = self._chat_bucket(chat_id).reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+            delay = self.overall.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self.stats['queue_depth'] -= 1
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint == 'getUpdates':
+            # Long polling has its own retry loop in the Updater
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get('chat_id')
+        # Answering a callback query does not count against chat limits
+        if endpoint == 'answerCallbackQuery':
+            chat_id = None
+
+        attempt = 0
+        while True:
+            await self._wait_for_slot(chat_id)
+            try:
+                result = await callback(*args, **kwargs)
+                self.stats['sent'] += 1
+                return result
+            except RetryAfter as e:
+                error, delay = e, e.retry_after + random.uniform(0, 1)
+            except (BadRequest, Forbidden, InvalidToken):
+                raise
+            except NetworkError as e:
+                if endpoint.startswith(NON_IDEMPOTENT_PREFIXES) and not request_not_sent(e):
+                    self.stats['drops'] += 1
+                    logger.error("%s failed after it may have reached Telegram, not retrying: %s", endpoint, e)
+                    raise
+                error, delay = e, self._backoff(attempt)
+                logger.warning("Network error on %s, retrying in %.1fs: %s", endpoint, delay, e)
+
+            if attempt >= self.max_retries:
+                self.stats['drops'] += 1
+                logger.error("Giving up on %s after %s attempts", endpoint, attempt + 1)
+                raise error
+            attempt += 1
+            self.stats['retries'] += 1
+            await asyncio.sleep(delay)
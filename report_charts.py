@@ -0,0 +1,126 @@
+"""رسم الرسوم البيانية لتقرير تحليل العملاء
+
+كل رسم يُبنى من مواصفات صغيرة (عنوان، تسميات، قيم) مستخرجة من نتيجة
+التحليل. الرسوم المستقلة تُرسم بالتوازي في عمليات منفصلة باستخدام واجهة
+Matplotlib الكائنية (بدون pyplot وحالته العامة)، ويُتخطى أي رسم لم تتغير
+بياناته منذ آخر مرة حسب بصمة البيانات المحفوظة.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+CACHE_FILE = '.chart_cache.json'
+# يُغيَّر عند تعديل شكل الرسوم لإجبار إعادة رسمها
+RENDER_VERSION = 1
+
+
+@lru_cache(maxsize=1024)
+def arabic_label(text):
+    """تشكيل النص العربي وترتيبه للعرض (مرة واحدة لكل نص)"""
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    return get_display(arabic_reshaper.reshape(str(text)))
+
+
+def chart_specs(result):
+    """مواصفات الرسوم الثلاثة المستخرجة من نتيجة التحليل"""
+    return [
+        {
+            'file': 'customer_types.png',
+            'kind': 'pie',
+            'figsize': (10, 6),
+            'title': arabic_label('توزيع أنواع العملاء'),
+            'labels': [arabic_label(label) for label in result.customer_types],
+            'values': list(result.customer_types.values()),
+        },
+        {
+            'file': 'contact_info.png',
+            'kind': 'bar',
+            'figsize': (10, 6),
+            'title': arabic_label('توفر معلومات الاتصال'),
+            'ylabel': arabic_label('عدد العملاء'),
+            'labels': [arabic_label('بريد إلكتروني'), arabic_label('رقم هاتف')],
+            'values': [result.email_count, result.phone_count],
+        },
+        {
+            'file': 'temporal_analysis.png',
+            'kind': 'line',
+            'figsize': (12, 6),
+            'title': arabic_label('اتجاه تسجيل العملاء'),
+            'xlabel': arabic_label('التاريخ'),
+            'ylabel': arabic_label('عدد العملاء'),
+            'labels': list(result.daily_counts),
+            'values': list(result.daily_counts.values()),
+        },
+    ]
+
+
+def spec_hash(spec):
+    payload = json.dumps([RENDER_VERSION, spec], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_chart(spec, path):
+    """رسم مخطط واحد وحفظه (يعمل داخل عملية منفصلة)"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=spec['figsize'])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    if spec['kind'] == 'pie':
+        ax.pie(spec['values'], labels=spec['labels'], autopct='%1.1f%%')
+    elif spec['kind'] == 'bar':
+        ax.bar(spec['labels'], spec['values'])
+    else:
+        from datetime import date
+        dates = [date.fromisoformat(label) for label in spec['labels']]
+        ax.plot(dates, spec['values'], marker='o')
+        ax.tick_params(axis='x', labelrotation=45)
+    ax.set_title(spec['title'])
+    if spec.get('xlabel'):
+        ax.set_xlabel(spec['xlabel'])
+    if spec.get('ylabel'):
+        ax.set_ylabel(spec['ylabel'])
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def render_charts(result, output_dir='.', max_workers=None):
+    """رسم الرسوم التي تغيرت بياناتها فقط، بالتوازي، وإرجاع أسماء الملفات المرسومة"""
+    cache_path = os.path.join(output_dir, CACHE_FILE)
+    cache = load_cache(cache_path)
+
+    pending = {}
+    for spec in chart_specs(result):
+        path = os.path.join(output_dir, spec['file'])
+        digest = spec_hash(spec)
+        if cache.get(spec['file']) == digest and os.path.exists(path):
+            continue
+        pending[spec['file']] = (spec, path, digest)
+
+    if len(pending) == 1:
+        spec, path, digest = next(iter(pending.values()))
+        render_chart(spec, path)
+    elif pending:
+        with ProcessPoolExecutor(max_workers=max_workers or min(len(pending), os.cpu_count() or 1)) as pool:
+            futures = [pool.submit(render_chart, spec, path) for spec, path, _ in pending.values()]
+            for future in futures:
+                future.result()
+
+    if pending:
+        cache.update({name: digest for name, (_, _, digest) in pending.items()})
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+    return list(pending)
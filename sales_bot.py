@@ -1,31 +1,81 @@
+import argparse
+import atexit
+import functools
 import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, MessageHandler, filters
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, MessageHandler, TypeHandler, filters
 from telegram.error import Conflict, NetworkError, BadRequest, TelegramError
-import openpyxl
-from openpyxl import Workbook
 import os
 import sys
 from pathlib import Path
-import time
 import asyncio
+from dotenv import load_dotenv
+from bot_persistence import LeadDraft, SQLitePersistence
+from lead_store import FIELD_NAMES, open_store, shard_names, shard_numbers, shard_path, store_path as lead_store_path
+from lead_alerts import HotLeadAlerter
+from lead_writer import LeadJournal, LeadWriter
+from metrics import REGISTRY, start_metrics_server
+from rate_limiter import OutboundRateLimiter
+from update_processor import PerUserUpdateProcessor
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# Enable logging; records go through a queue so file and console I/O
+# happen on a listener thread instead of the event loop
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [logging.FileHandler('bot.log'), logging.StreamHandler()]
+for log_handler in log_handlers:
+    log_handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+queue_handler = QueueHandler(log_queue)
+# Only merge the arguments here, the listener's handlers add the full format
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
 
 logger = logging.getLogger(__name__)
 
 # States for conversation
 CHOOSING, CLASSIFYING, GETTING_INFO, PRODUCT_TYPE, BUDGET, TIMELINE, COMPANY_INFO = range(7)
 
+# Metrics (exposed on METRICS_PORT when it is set)
+HANDLER_LATENCY = REGISTRY.histogram(
+    'bot_handler_latency_seconds', 'Time spent in conversation handlers', ['handler'])
+FUNNEL_TRANSITIONS = REGISTRY.counter(
+    'bot_funnel_transitions_total', 'Conversation state transitions by target state', ['state'])
+STORE_WRITE_LATENCY = REGISTRY.histogram(
+    'bot_lead_store_write_seconds', 'Time to write one batch of leads to the lead store')
+LEADS_SAVED = REGISTRY.counter('bot_leads_saved_total', 'Leads written to the lead store')
+REPEAT_LEADS = REGISTRY.counter(
+    'bot_repeat_leads_total', 'Leads merged into an existing lead with the same user, phone or email')
+
+STATE_NAMES = {
+    CHOOSING: 'CHOOSING',
+    CLASSIFYING: 'CLASSIFYING',
+    GETTING_INFO: 'GETTING_INFO',
+    PRODUCT_TYPE: 'PRODUCT_TYPE',
+    BUDGET: 'BUDGET',
+    TIMELINE: 'TIMELINE',
+    COMPANY_INFO: 'COMPANY_INFO',
+    ConversationHandler.END: 'END',
+}
+
+def instrumented(func):
+    """Record a handler's latency and the conversation state it moves to."""
+    timed = HANDLER_LATENCY.time(handler=func.__name__)(func)
+
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        state = await timed(update, context)
+        if state in STATE_NAMES:
+            FUNNEL_TRANSITIONS.inc(state=STATE_NAMES[state])
+        return state
+    return wrapper
+
 # Customer classifications
 CUSTOMER_TYPES = {
     'hot': 'عميل محتمل عالي',
@@ -41,80 +91,114 @@ PRODUCT_TYPES = {
     'other': 'أخرى'
 }
 
-# Excel file setup
-EXCEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'customer_data.xlsx')
+# Runtime configuration, read from the environment or a .env file
+load_dotenv()
+BOT_TOKEN = os.getenv('BOT_TOKEN', '7721450926:AAHc3xILNUT4JqRiQJs0WF3gSH9j3QdUndU')
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Bot API base URL, e.g. http://127.0.0.1:8081/bot for a local stand-in server
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '256'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Conversation states and lead drafts survive restarts in this database
+BOT_STATE_PATH = os.getenv('BOT_STATE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_state.db'))
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+# Leads not yet in the store are journaled here; shared by every bot process on the host
+LEAD_JOURNAL_DIR = os.getenv('LEAD_JOURNAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lead_journal'))
+# Abandoned conversations are ended and their drafts evicted after this many seconds
+CONVERSATION_TIMEOUT = float(os.getenv('CONVERSATION_TIMEOUT', '1800'))
+# Seconds between sweeps for conversations restored after a restart that were abandoned
+EVICTION_INTERVAL = 60
+# Hot leads are sent to this chat in digests (no alerts when unset)
+SALES_TEAM_CHAT_ID = os.getenv('SALES_TEAM_CHAT_ID')
+HOT_LEAD_ALERT_BATCH_SIZE = int(os.getenv('HOT_LEAD_ALERT_BATCH_SIZE', '50'))
+HOT_LEAD_ALERT_INTERVAL = float(os.getenv('HOT_LEAD_ALERT_INTERVAL', '60'))
 
-def setup_excel():
-    """Create or load Excel file with headers if it doesn't exist."""
-    try:
-        if not os.path.exists(EXCEL_FILE):
-            wb = Workbook()
-            ws = wb.active
-            headers = [
-                'التاريخ',
-                'اسم المستخدم',
-                'معرف المستخدم',
-                'نوع العميل',
-                'رقم الهاتف',
-                'البريد الإلكتروني',
-                'نوع المنتج',
-                'الميزانية المتوقعة',
-                'موعد الشراء المتوقع',
-                'اسم الشركة',
-                'حجم الشركة',
-                'ملاحظات إضافية'
-            ]
-            ws.append(headers)
-            wb.save(EXCEL_FILE)
-            logging.info(f"Created new Excel file at {EXCEL_FILE}")
-    except PermissionError:
-        logging.error(f"Permission denied when creating Excel file at {EXCEL_FILE}")
-        print(f"خطأ: لا يمكن الوصول إلى الملف {EXCEL_FILE}. تأكد من إغلاق الملف إذا كان مفتوحاً.")
-        sys.exit(1)
-    except Exception as e:
-        logging.error(f"Error creating Excel file: {str(e)}")
-        print(f"حدث خطأ أثناء إنشاء ملف Excel: {str(e)}")
-        sys.exit(1)
+# Only the update types the conversation handler consumes
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
-def save_to_excel(user_data):
-    """Save customer data to Excel file."""
-    try:
-        if not os.path.exists(EXCEL_FILE):
-            setup_excel()
-            
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        ws = wb.active
-        
-        # Prepare data row
-        data = [
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            user_data.get('username', ''),
-            user_data.get('user_id', ''),
-            user_data.get('customer_type', ''),
-            user_data.get('phone', ''),
-            user_data.get('email', ''),
-            user_data.get('product_type', ''),
-            user_data.get('budget', ''),
-            user_data.get('timeline', ''),
-            user_data.get('company_name', ''),
-            user_data.get('company_size', ''),
-            user_data.get('notes', '')
-        ]
-        
-        ws.append(data)
-        wb.save(EXCEL_FILE)
-        logging.info("Successfully saved customer data to Excel")
-    except PermissionError:
-        logging.error(f"Permission denied when saving to Excel file at {EXCEL_FILE}")
-        print(f"خطأ: لا يمكن حفظ البيانات في الملف {EXCEL_FILE}. تأكد من إغلاق الملف إذا كان مفتوحاً.")
-    except Exception as e:
-        logging.error(f"Error saving to Excel: {str(e)}")
-        print(f"حدث خطأ أثناء حفظ البيانات: {str(e)}")
+class BotShard:
+    """One bot token with its own lead store, conversation state, lead journal
+    and hot lead alerts.
+
+    Without BOT_SHARDS there is a single shard named '' that uses BOT_TOKEN,
+    LEAD_STORE_PATH, BOT_STATE_PATH and LEAD_JOURNAL_DIR. Shards can run
+    together in one process or in separate ones; ``ShardedLeadStore``
+    reads their stores together for reports.
+    """
+
+    def __init__(self, name, token, store_path=None, state_path=None, journal_dir=None,
+                 alert_chat_id=None):
+        self.name = name
+        self.token = token
+        self.store_path = store_path or lead_store_path(name)
+        self.state_path = state_path or shard_path(BOT_STATE_PATH, name)
+        self.store = None
+        # Finished leads are journaled, queued here and written in batches off the event loop
+        self.writer = LeadWriter(self.save_leads, journal=LeadJournal(
+            journal_dir or os.path.join(LEAD_JOURNAL_DIR, name)))
+        self.alerter = HotLeadAlerter(alert_chat_id, HOT_LEAD_ALERT_BATCH_SIZE, HOT_LEAD_ALERT_INTERVAL)
+
+    def setup_store(self):
+        """Open the lead store, creating it if it doesn't exist."""
+        try:
+            self.store = open_store(self.store_path)
+            logger.info("Using lead store at %s", self.store.path)
+        except PermissionError:
+            logger.error("Permission denied when opening the lead store")
+            print("خطأ: لا يمكن الوصول إلى ملف البيانات. تأكد من إغلاق الملف إذا كان مفتوحاً.")
+            sys.exit(1)
+        except Exception as e:
+            logger.error("Error opening lead store: %s", e)
+            print(f"حدث خطأ أثناء تجهيز ملف البيانات: {str(e)}")
+            sys.exit(1)
+
+    def save_leads(self, leads):
+        """Write a batch of finished leads, merging repeats into the existing leads."""
+        if self.store is None:
+            self.setup_store()
+        start = time.perf_counter()
+        inserted, updated = self.store.upsert_many(leads)
+        STORE_WRITE_LATENCY.observe(time.perf_counter() - start)
+        LEADS_SAVED.inc(len(leads))
+        REPEAT_LEADS.inc(updated)
+        logger.info("Successfully saved %s leads to %s (%s new, %s updated)",
+                    len(leads), self.name or 'the store', inserted, updated)
+
+def configured_shards(names=None):
+    """The bots to run: each of BOT_SHARDS (or just ``names``) with its
+    BOT_TOKEN_<NAME>, or the single BOT_TOKEN bot. A bot alerts
+    SALES_TEAM_CHAT_ID_<NAME> if set, else SALES_TEAM_CHAT_ID."""
+    if not shard_names():
+        return [BotShard('', BOT_TOKEN, alert_chat_id=SALES_TEAM_CHAT_ID)]
+    shards = []
+    for name in names or shard_names():
+        if name not in shard_names():
+            raise ValueError(f"Unknown shard {name}, BOT_SHARDS is {','.join(shard_names())}")
+        token = os.getenv(f'BOT_TOKEN_{name.upper()}')
+        if not token:
+            raise ValueError(f"BOT_TOKEN_{name.upper()} must be set for shard {name}")
+        shards.append(BotShard(name, token, alert_chat_id=os.getenv(
+            f'SALES_TEAM_CHAT_ID_{name.upper()}', SALES_TEAM_CHAT_ID)))
+    return shards
+
+def build_lead(user_data):
+    """Build the stored record for a finished lead."""
+    lead = {name: user_data.get(name) for name in FIELD_NAMES}
+    lead['created_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return lead
+
+# Shards whose application is running in this process
+running_shards = {}
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
     try:
-        logger.info(f"Help command received from user {update.effective_user.id}")
+        logger.info("Help command received from user %s", update.effective_user.id)
         await update.message.reply_text(
             "مرحباً بك في بوت المبيعات!\n\n"
             "الأوامر المتاحة:\n"
@@ -123,25 +207,26 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "/cancel - إلغاء المحادثة الحالية"
         )
     except Exception as e:
-        logger.error(f"Error in help command: {e}")
+        logger.error("Error in help command: %s", e)
         await update.message.reply_text("عذراً، حدث خطأ. يرجى المحاولة مرة أخرى.")
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel and end the conversation."""
     try:
-        logger.info(f"Cancel command received from user {update.effective_user.id}")
+        logger.info("Cancel command received from user %s", update.effective_user.id)
         await update.message.reply_text(
             "تم إلغاء المحادثة. يمكنك البدء من جديد باستخدام الأمر /start"
         )
         return ConversationHandler.END
     except Exception as e:
-        logger.error(f"Error in cancel command: {e}")
+        logger.error("Error in cancel command: %s", e)
         return ConversationHandler.END
 
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the conversation and ask user about their interest."""
     try:
-        logger.info(f"Start command received from user {update.effective_user.id}")
+        logger.info("Start command received from user %s", update.effective_user.id)
         
         # Clear any existing conversation data
         context.user_data.clear()
@@ -163,15 +248,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             "هل أنت مهتم بمنتجاتنا؟",
             reply_markup=reply_markup
         )
-        logger.info(f"Start message sent to user {update.effective_user.id}")
+        logger.info("Start message sent to user %s", update.effective_user.id)
         return CHOOSING
     except Exception as e:
-        logger.error(f"Error in start command: {e}")
+        logger.error("Error in start command: %s", e)
         await update.message.reply_text(
             "عذراً، حدث خطأ في بدء المحادثة. يرجى المحاولة مرة أخرى باستخدام /start"
         )
         return ConversationHandler.END
 
+@instrumented
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle button presses."""
     query = update.callback_query
@@ -213,8 +299,10 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await query.edit_message_text(
             "شكراً لوقتك! إذا كنت مهتماً في المستقبل، لا تتردد في التواصل معنا."
         )
+        context.application.drop_user_data(update.effective_user.id)
         return ConversationHandler.END
 
+@instrumented
 async def get_contact_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Get customer contact information."""
     text = update.message.text
@@ -244,6 +332,7 @@ async def get_contact_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         return PRODUCT_TYPE
 
+@instrumented
 async def get_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Get customer budget information."""
     context.user_data['budget'] = update.message.text
@@ -252,6 +341,7 @@ async def get_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     )
     return TIMELINE
 
+@instrumented
 async def get_timeline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Get customer timeline information."""
     context.user_data['timeline'] = update.message.text
@@ -260,6 +350,7 @@ async def get_timeline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     )
     return COMPANY_INFO
 
+@instrumented
 async def get_company_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Get company information."""
     text = update.message.text.lower()
@@ -284,73 +375,283 @@ async def get_company_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         else:
             context.user_data['notes'] = update.message.text
             
-        # Save all data to Excel
-        save_to_excel(context.user_data)
+        # Queue the lead for the background writer of this bot's shard and
+        # only tell the customer it is saved once it is in the journal
+        shard = context.bot_data['shard']
+        lead = build_lead(context.user_data)
+        durable = shard.writer.enqueue(lead)
+        if durable is not None:
+            await durable
+        if lead['customer_type'] == CUSTOMER_TYPES['hot']:
+            # Sent to the sales team with the next digest, the reply does not wait for it
+            shard.alerter.enqueue(lead)
         
         await update.message.reply_text(
             f"شكراً لك! تم تصنيفك كـ {context.user_data['customer_type']}.\n"
             "تم حفظ جميع معلوماتك وسيتواصل معك فريق المبيعات قريباً."
         )
+        # The lead is saved, the draft is no longer needed
+        context.application.drop_user_data(update.effective_user.id)
         return ConversationHandler.END
 
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Evict the draft of a conversation that was abandoned mid-funnel."""
+    user_id = update.effective_user.id if update.effective_user else None
+    logger.info("Conversation with user %s timed out", user_id)
+    if user_id is not None:
+        context.application.drop_user_data(user_id)
+
+async def evict_idle_conversations(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """End the conversations and drop the drafts of users with no update for
+    CONVERSATION_TIMEOUT seconds.
+
+    PTB only schedules the timeout of a conversation when it changes, so the
+    ones restored after a restart are ended here if the user never returns.
+    """
+    application = context.application
+    idle = await asyncio.get_running_loop().run_in_executor(
+        None, application.persistence.idle_users, CONVERSATION_TIMEOUT)
+    if not idle:
+        return
+    conversation = application.bot_data['conversation']
+    # ConversationHandler has no public way to end a conversation outside its
+    # handlers; this is what it does itself on END, and persistence follows
+    for key in [key for key in conversation._conversations if key[-1] in idle]:
+        conversation._update_state(ConversationHandler.END, key)
+    for user_id in idle:
+        application.drop_user_data(user_id)
+    logger.info("Evicted %s idle conversations", len(idle))
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle any message that is not a command."""
     try:
-        logger.info(f"Message received from user {update.effective_user.id}: {update.message.text}")
+        # Only the length is logged, message text may contain personal data
+        logger.info("Message received from user %s (%s chars)", update.effective_user.id, len(update.message.text or ''))
         await update.message.reply_text(
             "عذراً، لا أستطيع فهم هذه الرسالة.\n"
             "استخدم /start لبدء محادثة جديدة أو /help للحصول على المساعدة."
         )
     except Exception as e:
-        logger.error(f"Error in message handler: {e}")
+        logger.error("Error in message handler: %s", e)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle errors in the bot."""
-    logger.error(f"Update {update} caused error {context.error}")
+    logger.error("Update %s caused error %s", update, context.error)
     if isinstance(context.error, Conflict):
         print("خطأ: يبدو أن هناك نسخة أخرى من البوت تعمل بالفعل.")
         print("يرجى إغلاق جميع نسخ البوت الأخرى وإعادة المحاولة.")
-        sys.exit(1)
+        # Let run_polling/run_webhook shut down cleanly so queued leads are flushed
+        context.application.stop_running()
     elif isinstance(context.error, NetworkError):
-        print("خطأ في الاتصال بالإنترنت. جاري إعادة المحاولة...")
-        time.sleep(5)
+        # Outbound calls are already retried with backoff by the rate limiter
+        print("خطأ في الاتصال بالإنترنت بعد عدة محاولات.")
     else:
         print(f"حدث خطأ غير متوقع: {context.error}")
 
+def alert_stat(stat):
+    """Sum of a hot lead alert statistic over the bots running in this process."""
+    return sum(application.bot_data['shard'].alerter.stats[stat] for application in running_shards.values())
+
+def outbound_stat(stat):
+    """Sum of a rate limiter statistic over the bots running in this process."""
+    return sum(application.bot.rate_limiter.stats[stat]
+               for application in running_shards.values() if application.bot.rate_limiter is not None)
+
+async def post_init(application: Application) -> None:
+    """Start background services once the application is initialized."""
+    shard = application.bot_data['shard']
+    await shard.writer.start()
+    await shard.alerter.start(application.bot)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(
+            evict_idle_conversations, interval=min(CONVERSATION_TIMEOUT, EVICTION_INTERVAL),
+            name='evict_idle_conversations')
+    running_shards[shard.name] = application
+    REGISTRY.gauge('bot_lead_writer_queue_depth', 'Finished leads waiting to be written',
+                   lambda: sum(app.bot_data['shard'].writer.pending() for app in running_shards.values()))
+    REGISTRY.gauge('bot_hot_lead_alerts_queue_depth', 'Hot leads waiting for the next digest',
+                   lambda: sum(app.bot_data['shard'].alerter.pending() for app in running_shards.values()))
+    for stat in ('leads', 'digests', 'messages', 'failures'):
+        REGISTRY.gauge(f'bot_hot_lead_alert_{stat}_total', f'Hot lead alert {stat}',
+                       functools.partial(alert_stat, stat), kind='counter')
+    if application.bot.rate_limiter is not None:
+        REGISTRY.gauge('bot_outbound_queue_depth', 'Outbound Bot API calls waiting for a slot',
+                       functools.partial(outbound_stat, 'queue_depth'))
+        for stat in ('sent', 'retries', 'drops'):
+            REGISTRY.gauge(f'bot_outbound_{stat}_total', f'Outbound Bot API calls {stat}',
+                           functools.partial(outbound_stat, stat), kind='counter')
+
+async def post_stop(application: Application) -> None:
+    """Send the hot lead alerts still queued while the bot can reach Telegram."""
+    await application.bot_data['shard'].alerter.stop()
+
+async def post_shutdown(application: Application) -> None:
+    """Flush queued leads before the process exits."""
+    shard = application.bot_data['shard']
+    await shard.writer.stop()
+    running_shards.pop(shard.name, None)
+    if application.bot.rate_limiter is not None:
+        logger.info("Outbound Bot API stats: %s", application.bot.rate_limiter.stats)
+
+def build_application(shard=None, base_url=None, request=None, rate_limit=True) -> Application:
+    """Create the Application of ``shard`` (the single configured bot by
+    default) with the sales conversation registered.
+
+    ``request`` replaces the HTTP client used for Bot API calls (the load
+    test passes a fake one) and ``rate_limit=False`` sends without the
+    outbound rate limiter.
+    """
+    shard = shard or configured_shards()[0]
+    builder = (
+        Application.builder()
+        .token(shard.token)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .context_types(ContextTypes(user_data=LeadDraft))
+        .persistence(SQLitePersistence(
+            shard.state_path,
+            update_interval=PERSISTENCE_INTERVAL,
+            max_age=CONVERSATION_TIMEOUT,
+        ))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url or TELEGRAM_API_URL:
+        builder = builder.base_url(base_url or TELEGRAM_API_URL)
+    if rate_limit:
+        builder = builder.rate_limiter(OutboundRateLimiter())
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    # bot_data is not persisted, it only carries the shard and the
+    # conversation to the handlers and jobs
+    application.bot_data['shard'] = shard
+
+    # Add error handler
+    application.add_error_handler(error_handler)
+
+    # Add conversation handler
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            CHOOSING: [CallbackQueryHandler(button)],
+            CLASSIFYING: [CallbackQueryHandler(button)],
+            GETTING_INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_contact_info)],
+            PRODUCT_TYPE: [CallbackQueryHandler(button)],
+            BUDGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_budget)],
+            TIMELINE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_timeline)],
+            COMPANY_INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_company_info)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
+        },
+        fallbacks=[],
+        name='sales_conversation',
+        persistent=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+    )
+
+    application.add_handler(conv_handler)
+    application.bot_data['conversation'] = conv_handler
+    return application
+
+def webhook_port(shard):
+    """WEBHOOK_PORT_<NAME>, else WEBHOOK_PORT plus the shard's registered
+    number, so a bot keeps its port when BOT_SHARDS is reordered."""
+    if not shard.name:
+        return WEBHOOK_PORT
+    port = os.getenv(f'WEBHOOK_PORT_{shard.name.upper()}')
+    if port:
+        return int(port)
+    return WEBHOOK_PORT + shard_numbers([shard.name])[shard.name]
+
+def webhook_options(shard):
+    """Webhook server settings of ``shard``."""
+    url_path = f"{WEBHOOK_PATH}/{shard.name}" if shard.name else WEBHOOK_PATH
+    return dict(
+        listen=WEBHOOK_LISTEN,
+        port=webhook_port(shard),
+        url_path=url_path,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=ALLOWED_UPDATES,
+        max_connections=100,
+    )
+
+def run_application(application: Application) -> None:
+    """Run the application in the configured mode (polling or webhook)."""
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+        application.run_webhook(**webhook_options(application.bot_data['shard']))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+async def start_shard(application: Application) -> None:
+    """Start one of several bots sharing the event loop, as run_polling/run_webhook would."""
+    await application.initialize()
+    await application.post_init(application)
+    if BOT_MODE == 'webhook':
+        await application.updater.start_webhook(**webhook_options(application.bot_data['shard']))
+    else:
+        await application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+    await application.start()
+
+async def stop_shard(application: Application) -> None:
+    """Stop one bot in the order run_polling/run_webhook use."""
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+def run_shards(applications) -> None:
+    """Run several bots on one event loop until Ctrl+C (or stop_running())."""
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    started = []
+    try:
+        for application in applications:
+            loop.run_until_complete(start_shard(application))
+            started.append(application)
+        # Like run_polling, so an error handler's stop_running() stops every bot
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for application in started:
+            loop.run_until_complete(stop_shard(application))
+        loop.close()
+
 def main() -> None:
-    """Start the bot."""
+    """Start the bot, or the bots of BOT_SHARDS."""
+    parser = argparse.ArgumentParser(description='بوت المبيعات')
+    parser.add_argument('--shard', action='append',
+                        help='تشغيل هذا البوت فقط من BOT_SHARDS (يمكن تكراره)')
+    args = parser.parse_args()
     try:
-        # Setup Excel file
-        setup_excel()
-        
-        # Create the Application and pass it your bot's token
-        application = Application.builder().token('7721450926:AAHc3xILNUT4JqRiQJs0WF3gSH9j3QdUndU').build()
-
-        # Add error handler
-        application.add_error_handler(error_handler)
-
-        # Add conversation handler
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', start)],
-            states={
-                CHOOSING: [CallbackQueryHandler(button)],
-                CLASSIFYING: [CallbackQueryHandler(button)],
-                GETTING_INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_contact_info)],
-                PRODUCT_TYPE: [CallbackQueryHandler(button)],
-                BUDGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_budget)],
-                TIMELINE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_timeline)],
-                COMPANY_INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_company_info)],
-            },
-            fallbacks=[],
-        )
+        shards = configured_shards(args.shard)
+        # Setup lead stores
+        for shard in shards:
+            shard.setup_store()
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
 
-        application.add_handler(conv_handler)
+        applications = [build_application(shard) for shard in shards]
 
-        print("جاري تشغيل البوت...")
+        if len(shards) > 1 or shards[0].name:
+            print(f"جاري تشغيل {len(shards)} بوت: {', '.join(shard.name for shard in shards)}")
+        else:
+            print("جاري تشغيل البوت...")
         print("اضغط Ctrl+C للإيقاف")
         
         # Start the Bot
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if len(applications) == 1:
+            run_application(applications[0])
+        else:
+            run_shards(applications)
         
     except Conflict:
         print("خطأ: يبدو أن هناك نسخة أخرى من البوت تعمل بالفعل.")
@@ -361,4 +662,4 @@ def main() -> None:
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
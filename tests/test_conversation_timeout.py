@@ -0,0 +1,44 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+import sales_bot
+from benchmarks.fake_bot import FakeBotAPI
+
+USER_ID = 1001
+
+
+def test_restored_conversation_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(sales_bot, 'CONVERSATION_TIMEOUT', 2)
+    state_path = str(tmp_path / 'bot_state.db')
+    shard = sales_bot.BotShard('', '123456:TEST', store_path=str(tmp_path / 'leads.db'),
+                               state_path=state_path, journal_dir=str(tmp_path / 'journal'))
+    application = sales_bot.build_application(shard, request=FakeBotAPI(), rate_limit=False)
+
+    # A conversation left mid-funnel by the previous run of the bot
+    now = time.time()
+    with sqlite3.connect(state_path) as conn:
+        conn.executemany('INSERT INTO state (kind, key, value, updated_at) VALUES (?, ?, ?, ?)', [
+            ('conversation:sales_conversation', json.dumps([USER_ID, USER_ID]), json.dumps(sales_bot.BUDGET), now),
+            ('user', str(USER_ID), json.dumps({'customer_type': 'عميل محتمل عالي'}), now),
+        ])
+
+    async def run():
+        async with application:
+            await application.post_init(application)
+            await application.start()
+            conversation = application.bot_data['conversation']
+            restored = (dict(conversation._conversations), USER_ID in application.user_data)
+            await asyncio.sleep(5)
+            evicted = (dict(conversation._conversations), USER_ID in application.user_data)
+            await application.stop()
+            await application.post_stop(application)
+        await application.post_shutdown(application)
+        return restored, evicted
+
+    restored, evicted = asyncio.run(run())
+    assert restored == ({(USER_ID, USER_ID): sales_bot.BUDGET}, True)
+    assert evicted == ({}, False)
+    with sqlite3.connect(state_path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM state').fetchone()[0] == 0
@@ -0,0 +1,26 @@
+from lead_store import SQLiteLeadStore
+
+
+def test_phone_match_from_another_user_keeps_owner(tmp_path):
+    store = SQLiteLeadStore(str(tmp_path / 'leads.db'))
+    store.upsert_many([{'user_id': 1001, 'username': 'first', 'phone': '0501234567', 'customer_type': 'عميل محتمل'}])
+
+    # Another Telegram account leaves the same phone number
+    inserted, updated = store.upsert_many([{'user_id': 2002, 'username': 'second', 'phone': '050 123 4567',
+                                            'customer_type': 'عميل محتمل عالي'}])
+
+    assert (inserted, updated) == (0, 1)
+    [lead] = store.query()
+    assert lead['user_id'] == 1001
+    assert lead['customer_type'] == 'عميل محتمل عالي'
+
+    # The second user was not recorded as the row's owner, so their next lead
+    # without a phone is a new customer; the first user's still merges
+    assert store.upsert_many([{'user_id': 2002, 'email': 'second@example.com'}]) == (1, 0)
+    assert store.upsert_many([{'user_id': 1001, 'budget': '50 ألف ريال'}]) == (0, 1)
+    assert [lead['user_id'] for lead in store.query()] == [1001, 2002]
+
+    # The same holds once the index is rebuilt from the database
+    reopened = SQLiteLeadStore(str(tmp_path / 'leads.db'))
+    assert reopened.upsert_many([{'user_id': 3003, 'phone': '0501234567', 'notes': 'اتصل مرة أخرى'}]) == (0, 1)
+    assert [(lead['user_id'], lead['notes']) for lead in reopened.query()] == [(1001, 'اتصل مرة أخرى'), (2002, None)]
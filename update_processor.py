@@ -0,0 +1,62 @@
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+UNLIMITED = 2 ** 31
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates in order.
+
+    Updates from different users run side by side (up to
+    ``max_concurrent_updates``, kept in ``limit``), so one slow
+    conversation does not stall the others. Updates from the same user wait
+    on that user's lock, which keeps the ``ConversationHandler`` state
+    transitions sequential, before taking one of the shared slots.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        # The base class's semaphore is taken before do_process_update, so
+        # it gets a limit it never reaches and the real one is applied here,
+        # after the user's lock: updates queued behind a busy conversation
+        # then hold no slot meanwhile
+        super().__init__(UNLIMITED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+
+    @staticmethod
+    def _key(update):
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return ('user', user.id)
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return ('chat', chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._locks.clear()